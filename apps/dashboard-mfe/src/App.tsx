@@ -1,38 +1,27 @@
-import React, { useCallback, useEffect, useMemo, useState } from "react";
+import React, { useCallback, useEffect, useState } from "react";
 import { api } from "./api";
 
-interface Order {
-    id: number;
-    status: string;
-    total_amount: string;
-}
-interface StockItem {
-    product_id: string;
-    available: number;
+interface DashboardSummary {
+    // Either half is null when its service failed
+    orders: {
+        total_orders: number;
+        total_amount: string;
+        recent: { id: number; status: string }[];
+    } | null;
+    stock: {
+        total_available: number;
+        low_stock_count: number;
+    } | null;
 }
 
 export default function App() {
-    const [orders, setOrders] = useState<Order[]>([]);
-    const [stock, setStock] = useState<StockItem[]>([]);
+    const [summary, setSummary] = useState<DashboardSummary | null>(null);
     const [loading, setLoading] = useState(true);
 
     const load = useCallback(() => {
         setLoading(true);
-        Promise.all([api<Order[]>("/orders"), api<StockItem[]>("/stock")])
-            .then(([o, s]) => {
-                const normalizedOrders = Array.isArray(o)
-                    ? o
-                    : Array.isArray((o as any)?.results)
-                    ? ((o as any).results as Order[])
-                    : [];
-                const normalizedStock = Array.isArray(s)
-                    ? s
-                    : Array.isArray((s as any)?.results)
-                    ? ((s as any).results as StockItem[])
-                    : [];
-                setOrders(normalizedOrders);
-                setStock(normalizedStock);
-            })
+        api<DashboardSummary>("/dashboard/summary")
+            .then(setSummary)
             .catch(() => {})
             .finally(() => setLoading(false));
     }, []);
@@ -41,20 +30,9 @@ export default function App() {
         load();
     }, [load]);
 
-    const safeOrders = useMemo<Order[]>(
-        () => (Array.isArray(orders) ? orders : []),
-        [orders]
-    );
-    const safeStock = useMemo<StockItem[]>(
-        () => (Array.isArray(stock) ? stock : []),
-        [stock]
-    );
-
-    const totalOrders = safeOrders.length;
-    const lowStockCount = useMemo(
-        () => safeStock.filter((s) => s.available <= 5).length,
-        [safeStock]
-    );
+    const totalOrders = summary?.orders?.total_orders ?? 0;
+    const lowStockCount = summary?.stock?.low_stock_count ?? 0;
+    const recentOrders = summary?.orders?.recent ?? [];
 
     if (loading) return <p>Loading dashboard...</p>;
 
@@ -73,8 +51,7 @@ export default function App() {
                 <div className="rounded-lg border bg-white p-6 shadow">
                     <p className="text-sm text-slate-500">Recent</p>
                     <p className="text-sm">
-                        {safeOrders
-                            .slice(0, 3)
+                        {recentOrders
                             .map((o) => `#${o.id} ${o.status}`)
                             .join(" · ") || "No orders"}
                     </p>
@@ -0,0 +1,91 @@
+"""Compare two bench/run.py result files route by route.
+
+    python bench/compare.py bench/results/before.json bench/results/after.json
+
+Exits with status 1 when a route's p95 grows by more than --threshold
+percent, its throughput drops by more than that, or it runs more SQL
+queries per request than before.
+"""
+
+import argparse
+import json
+import sys
+
+
+def _pct(old: float, new: float) -> float:
+    if not old:
+        return 0.0
+    return (new - old) / old * 100
+
+
+def compare_routes(base: dict, head: dict, threshold: float) -> list:
+    regressions = []
+    print(f"{'route':32} {'p50':>16} {'p95':>16} {'p99':>16} {'req/s':>16}")
+    for route in sorted(set(base["routes"]) | set(head["routes"])):
+        old, new = base["routes"].get(route), head["routes"].get(route)
+        if old is None or new is None:
+            print(f"{route:32} only in {'head' if old is None else 'base'}")
+            continue
+        cells = []
+        for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+            cells.append(f"{new[key]:>8} {_pct(old[key], new[key]):>+6.1f}%")
+        print(f"{route:32} {' '.join(cells)}")
+        if _pct(old["p95_ms"], new["p95_ms"]) > threshold:
+            regressions.append(f"{route}: p95 {old['p95_ms']} -> {new['p95_ms']} ms")
+        if _pct(old["throughput_rps"], new["throughput_rps"]) < -threshold:
+            regressions.append(
+                f"{route}: throughput {old['throughput_rps']} -> "
+                f"{new['throughput_rps']} req/s"
+            )
+    return regressions
+
+
+def compare_queries(base: dict, head: dict) -> list:
+    regressions = []
+    for service, report in sorted(head.get("services", {}).items()):
+        old_routes = base.get("services", {}).get(service, {}).get("routes", {})
+        for route, new in sorted(report["routes"].items()):
+            old = old_routes.get(route)
+            if old is None or "queries_per_request" not in new:
+                continue
+            before, after = old["queries_per_request"], new["queries_per_request"]
+            if after != before:
+                print(f"{service} {route}: {before} -> {after} queries/request")
+            if after > before:
+                regressions.append(
+                    f"{service} {route}: {before} -> {after} queries/request"
+                )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=10, help="percent")
+    args = parser.parse_args()
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+    for name, result in (("base", base), ("head", head)):
+        meta = result.get("meta", {})
+        print(f"{name}: {meta.get('commit', '?')[:8]} {meta.get('args', {})}")
+    settings = ("mix", "users", "duration", "workers")
+    if any(
+        base["meta"]["args"].get(k) != head["meta"]["args"].get(k) for k in settings
+    ):
+        print("warning: runs used different load settings")
+    print()
+    regressions = compare_routes(base, head, args.threshold)
+    print()
+    regressions += compare_queries(base, head)
+    if regressions:
+        print("\nRegressions:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
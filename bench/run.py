@@ -0,0 +1,474 @@
+"""Boot gateway, auth, orders and inventory locally and drive a request mix
+through the gateway. Reports throughput, p50/p95/p99 per route and SQL
+queries per request, and saves everything as JSON for bench/compare.py.
+
+    python bench/run.py --mix default --users 32 --duration 30
+
+Services run as they do in docker-compose (gunicorn for the upstreams,
+daphne for the gateway) against throwaway SQLite files, with in-memory
+stand-ins for Redis. --target points the load at an already running
+gateway instead; SQL counts are then not collected.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+from prometheus_client.parser import text_string_to_metric_families
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+JWT_SECRET = "bench-secret-0123456789abcdef0123456789"
+PASSWORD = "bench-password"
+PRODUCTS = 50
+
+# Relative weight of each operation per iteration of a virtual user
+MIXES = {
+    "default": {"login": 5, "list_orders": 35, "create_order": 20, "stock_poll": 40},
+    "read": {"login": 2, "list_orders": 48, "create_order": 0, "stock_poll": 50},
+    "write": {"login": 5, "list_orders": 15, "create_order": 70, "stock_poll": 10},
+}
+
+UPSTREAMS = {
+    "auth": "auth_service",
+    "orders": "orders_service",
+    "inventory": "inventory_service",
+}
+
+
+class Stack:
+    """The four services as subprocesses on consecutive ports from `base_port`."""
+
+    def __init__(self, base_port: int, workers: int, workdir: Path):
+        self.workers = workers
+        self.workdir = workdir
+        self.ports = {
+            "gateway": base_port,
+            "auth": base_port + 1,
+            "orders": base_port + 2,
+            "inventory": base_port + 3,
+        }
+        self.procs = {}
+
+    def url(self, service: str) -> str:
+        return f"http://127.0.0.1:{self.ports[service]}"
+
+    def _env(self, service: str) -> dict:
+        env = dict(os.environ)
+        metrics_dir = self.workdir / f"metrics-{service}"
+        metrics_dir.mkdir()
+        env.update(
+            DEBUG="0",
+            JWT_SECRET_KEY=JWT_SECRET,
+            DB_PATH=str(self.workdir / f"{service}.sqlite3"),
+            REDIS_URL="",
+            TRACE_EXPORTER="none",
+            PROMETHEUS_MULTIPROC_DIR=str(metrics_dir),
+            AUTH_SERVICE_URL=self.url("auth"),
+            ORDERS_SERVICE_URL=self.url("orders"),
+            INVENTORY_SERVICE_URL=self.url("inventory"),
+        )
+        if service == "gateway":
+            # daphne is a single process: keep its metrics in memory
+            del env["PROMETHEUS_MULTIPROC_DIR"]
+        return env
+
+    def _spawn(self, service: str, cmd: list, env: dict) -> None:
+        log = open(self.workdir / f"{service}.log", "w")
+        self.procs[service] = subprocess.Popen(
+            cmd,
+            cwd=ROOT / "services" / service,
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+
+    def start(self) -> None:
+        for service, package in UPSTREAMS.items():
+            env = self._env(service)
+            subprocess.run(
+                [sys.executable, "manage.py", "migrate", "--noinput", "-v0"],
+                cwd=ROOT / "services" / service,
+                env=env,
+                check=True,
+            )
+            self._spawn(
+                service,
+                [
+                    sys.executable,
+                    "-m",
+                    "gunicorn",
+                    "--bind",
+                    f"127.0.0.1:{self.ports[service]}",
+                    "--workers",
+                    str(self.workers),
+                    "--threads",
+                    "4",
+                    "--keep-alive",
+                    "5",
+                    f"{package}.wsgi:application",
+                ],
+                env,
+            )
+        self._spawn(
+            "gateway",
+            [
+                sys.executable,
+                "-m",
+                "daphne",
+                "-b",
+                "127.0.0.1",
+                "-p",
+                str(self.ports["gateway"]),
+                "gateway.asgi:application",
+            ],
+            self._env("gateway"),
+        )
+        for service in self.ports:
+            self._wait_ready(service)
+
+    def _wait_ready(self, service: str, timeout: float = 30) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.procs[service].poll() is not None:
+                break
+            try:
+                if httpx.get(f"{self.url(service)}/metrics").status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        log = (self.workdir / f"{service}.log").read_text()[-2000:]
+        raise RuntimeError(f"{service} did not start:\n{log}")
+
+    def stop(self) -> None:
+        for proc in self.procs.values():
+            proc.terminate()
+        for proc in self.procs.values():
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def scrape(urls: dict) -> dict:
+    """Sum and count of the per-request SQL and span histograms, per service."""
+    wanted = {
+        "db_queries_per_request",
+        "db_time_per_request_seconds",
+        "span_duration_seconds",
+    }
+    out = {}
+    for service, url in urls.items():
+        text = httpx.get(f"{url}/metrics").text
+        values = {}
+        for family in text_string_to_metric_families(text):
+            if family.name not in wanted:
+                continue
+            for sample in family.samples:
+                kind = sample.name[len(family.name) + 1 :]
+                if kind not in ("sum", "count"):
+                    continue
+                label = sample.labels.get("route") or sample.labels.get("span")
+                values[(family.name, label, kind)] = sample.value
+        out[service] = values
+    return out
+
+
+def db_report(before: dict, after: dict) -> dict:
+    report = {}
+    for service, values in after.items():
+        rows = defaultdict(dict)
+        for (family, label, kind), value in values.items():
+            delta = value - before[service].get((family, label, kind), 0)
+            rows[(family, label)][kind] = delta
+        routes, spans = {}, {}
+        for (family, label), v in rows.items():
+            # Skip routes with no traffic in the window and our own scrapes
+            if not v.get("count") or label == "metrics":
+                continue
+            if family == "db_queries_per_request":
+                routes.setdefault(label, {})["requests"] = int(v["count"])
+                routes[label]["queries_per_request"] = round(v["sum"] / v["count"], 2)
+            elif family == "db_time_per_request_seconds":
+                routes.setdefault(label, {})["db_ms_per_request"] = round(
+                    v["sum"] / v["count"] * 1000, 3
+                )
+            else:
+                spans[label] = {
+                    "count": int(v["count"]),
+                    "mean_ms": round(v["sum"] / v["count"] * 1000, 3),
+                }
+        report[service] = {"routes": routes, "spans": spans}
+    return report
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.recording = False
+
+    def add(self, route: str, seconds: float, ok: bool) -> None:
+        if not self.recording:
+            return
+        self.samples[route].append(seconds)
+        if not ok:
+            self.errors[route] += 1
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    index = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def latency_report(recorder: Recorder, seconds: float) -> dict:
+    routes = {}
+    for route, samples in sorted(recorder.samples.items()):
+        values = sorted(samples)
+        routes[route] = {
+            "count": len(values),
+            "errors": recorder.errors[route],
+            "throughput_rps": round(len(values) / seconds, 2),
+            "mean_ms": round(sum(values) / len(values) * 1000, 2),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2),
+        }
+    return routes
+
+
+class User:
+    """One virtual user: its own account, token and random stream."""
+
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, name: str, seed):
+        self.client = client
+        self.recorder = recorder
+        self.name = name
+        self.rng = random.Random(seed)
+        self.headers = {}
+
+    async def call(self, route: str, method: str, path: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = await self.client.request(
+                method, path, headers=self.headers, **kwargs
+            )
+        except httpx.HTTPError:
+            self.recorder.add(route, time.perf_counter() - start, False)
+            return None
+        self.recorder.add(route, time.perf_counter() - start, resp.status_code < 400)
+        return resp
+
+    async def register(self) -> None:
+        resp = await self.client.post(
+            "/api/auth/register",
+            json={
+                "username": self.name,
+                "email": f"{self.name}@bench.local",
+                "password": PASSWORD,
+            },
+        )
+        resp.raise_for_status()
+        self.headers = {"Authorization": f"Bearer {resp.json()['access']}"}
+
+    async def login(self) -> None:
+        resp = await self.call(
+            "POST /api/auth/login",
+            "POST",
+            "/api/auth/login",
+            json={"username": self.name, "password": PASSWORD},
+        )
+        if resp is not None and resp.status_code == 200:
+            self.headers = {"Authorization": f"Bearer {resp.json()['access']}"}
+
+    async def list_orders(self) -> None:
+        await self.call("GET /api/orders", "GET", "/api/orders", params={"limit": 20})
+
+    async def create_order(self) -> None:
+        products = self.rng.sample(range(PRODUCTS), self.rng.randint(1, 3))
+        items = [
+            {"product_id": f"bench-{p}", "quantity": self.rng.randint(1, 3)}
+            for p in products
+        ]
+        resp = await self.call(
+            "POST /api/orders",
+            "POST",
+            "/api/orders",
+            json={"items": [dict(i, unit_price="9.99") for i in items]},
+        )
+        if resp is None or resp.status_code != 200:
+            return
+        await self.call(
+            "POST /api/reserve/batch",
+            "POST",
+            "/api/reserve/batch",
+            json={"order_id": str(resp.json()["id"]), "items": items},
+        )
+
+    async def stock_poll(self) -> None:
+        product = self.rng.randrange(PRODUCTS)
+        await self.call(
+            "GET /api/stock/{product_id}", "GET", f"/api/stock/bench-{product}"
+        )
+
+    async def run(self, mix: dict, deadline: float) -> None:
+        ops = [getattr(self, name) for name in mix]
+        weights = list(mix.values())
+        while time.monotonic() < deadline:
+            await self.rng.choices(ops, weights)[0]()
+
+
+async def seed_stock(client: httpx.AsyncClient, headers: dict) -> None:
+    for p in range(PRODUCTS):
+        resp = await client.post(
+            "/api/stock",
+            json={"product_id": f"bench-{p}", "quantity": 10**9},
+            headers=headers,
+        )
+        resp.raise_for_status()
+
+
+async def drive(args, gateway_url: str, metrics_urls: dict) -> dict:
+    mix = {name: w for name, w in MIXES[args.mix].items() if w}
+    run_id = uuid.uuid4().hex[:8]
+    recorder = Recorder()
+    limits = httpx.Limits(
+        max_connections=args.users, max_keepalive_connections=args.users
+    )
+    async with httpx.AsyncClient(
+        base_url=gateway_url, limits=limits, timeout=60
+    ) as client:
+        users = [
+            User(client, recorder, f"bench-{run_id}-{i}", args.seed * 10000 + i)
+            for i in range(args.users)
+        ]
+        await asyncio.gather(*(u.register() for u in users))
+        await seed_stock(client, users[0].headers)
+
+        start = time.monotonic()
+        deadline = start + args.warmup + args.duration
+        tasks = [asyncio.create_task(u.run(mix, deadline)) for u in users]
+        await asyncio.sleep(args.warmup)
+        before = scrape(metrics_urls)
+        recorder.recording = True
+        measured_from = time.monotonic()
+        await asyncio.gather(*tasks)
+        recorder.recording = False
+        measured = time.monotonic() - measured_from
+        after = scrape(metrics_urls)
+
+    routes = latency_report(recorder, measured)
+    total = sum(r["count"] for r in routes.values())
+    return {
+        "summary": {
+            "duration_s": round(measured, 2),
+            "requests": total,
+            "errors": sum(r["errors"] for r in routes.values()),
+            "throughput_rps": round(total / measured, 2),
+        },
+        "routes": routes,
+        "services": db_report(before, after),
+    }
+
+
+def _git(*args) -> str:
+    try:
+        return subprocess.run(
+            ["git", *args], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def print_report(result: dict) -> None:
+    s = result["summary"]
+    print(
+        f"\n{s['requests']} requests in {s['duration_s']}s: "
+        f"{s['throughput_rps']} req/s, {s['errors']} errors\n"
+    )
+    print(f"{'route':32} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'err':>5}")
+    for route, r in result["routes"].items():
+        print(
+            f"{route:32} {r['throughput_rps']:>8} {r['p50_ms']:>8} "
+            f"{r['p95_ms']:>8} {r['p99_ms']:>8} {r['errors']:>5}"
+        )
+    for service, report in result["services"].items():
+        for route, r in sorted(report["routes"].items()):
+            if "queries_per_request" in r:
+                print(
+                    f"{service:10} {route:32} {r['queries_per_request']:>6} "
+                    f"queries  {r.get('db_ms_per_request', 0):>8} ms SQL"
+                )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--mix", choices=sorted(MIXES), default="default")
+    parser.add_argument("--users", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--base-port", type=int, default=18100)
+    parser.add_argument("--target", help="gateway URL of an already running stack")
+    parser.add_argument("--output", help="result file (default bench/results/)")
+    args = parser.parse_args()
+
+    started_at = datetime.now(timezone.utc)
+    if args.target:
+        result = asyncio.run(drive(args, args.target.rstrip("/"), {}))
+    else:
+        with tempfile.TemporaryDirectory(prefix="soa-bench-") as workdir:
+            stack = Stack(args.base_port, args.workers, Path(workdir))
+            try:
+                stack.start()
+                result = asyncio.run(
+                    drive(
+                        args,
+                        stack.url("gateway"),
+                        {s: stack.url(s) for s in stack.ports},
+                    )
+                )
+            finally:
+                stack.stop()
+
+    commit = _git("rev-parse", "HEAD")
+    result["meta"] = {
+        "commit": commit,
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "started_at": started_at.isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+    }
+    print_report(result)
+    output = (
+        Path(args.output)
+        if args.output
+        else (
+            RESULTS_DIR
+            / f"{started_at:%Y%m%dT%H%M%S}-{commit[:8] or 'nogit'}-{args.mix}.json"
+        )
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2, sort_keys=True) + "\n")
+    print(f"\nSaved {output}")
+
+
+if __name__ == "__main__":
+    main()
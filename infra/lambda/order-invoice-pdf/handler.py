@@ -11,6 +11,9 @@ def handler(event, context):
     if not order_id:
         return {"statusCode": 400, "body": json.dumps({"error": "order_id required"})}
 
+    # Ties the CloudWatch log line to the gateway request that invoked us
+    print(json.dumps({"order_id": order_id, "traceparent": body.get("traceparent")}))
+
    
     invoice_id = f"inv-{order_id}-{datetime.utcnow().strftime('%Y%m%d%H%M')}"
     bucket = os.environ.get("INVOICE_BUCKET", "invoices")
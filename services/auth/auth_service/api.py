@@ -3,10 +3,11 @@ from ninja import NinjaAPI
 from ninja.errors import HttpError
 
 from .jwt_utils import encode_access, encode_refresh, decode_token
+from .metrics import TimedJSONRenderer
 from .models import User
 from .schemas import LoginIn, RegisterIn, RefreshIn, TokenOut, VerifyIn, VerifyOut
 
-api = NinjaAPI(title="Auth API", version="1.0")
+api = NinjaAPI(title="Auth API", version="1.0", renderer=TimedJSONRenderer())
 
 
 @api.post("/register", response=TokenOut)
@@ -14,6 +14,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "auth_service.tracing.tracing_middleware",
+    "auth_service.metrics.metrics_middleware",
     "django.middleware.security.SecurityMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
@@ -40,3 +42,9 @@ JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "jwt-secret-change-in-producti
 JWT_ALGORITHM = "HS256"
 JWT_ACCESS_TTL = 3600
 JWT_REFRESH_TTL = 86400 * 7
+
+# Request tracing: span records go to TRACE_EXPORTER ("none", "jsonl" to
+# TRACE_FILE, "memory", or the dotted path of an exporter class)
+TRACE_SERVICE = "auth"
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "none")
+TRACE_FILE = os.environ.get("TRACE_FILE", "/tmp/traces-auth.jsonl")
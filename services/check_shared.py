@@ -0,0 +1,69 @@
+"""Check that the modules copied into several services are still identical.
+
+    python services/check_shared.py          # exit 1 and show a diff on drift
+    python services/check_shared.py --fix    # copy the first file over the rest
+
+Every image is built from its own service directory, so code shared by
+several services lives in each of them; edit one copy, then run --fix.
+"""
+
+import argparse
+import difflib
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+
+# Each group must be byte-identical; the first file is the one --fix keeps
+SHARED = [
+    [
+        "orders/orders_service/metrics.py",
+        "inventory/inventory_service/metrics.py",
+        "auth/auth_service/metrics.py",
+        "gateway/gateway/metrics.py",
+    ],
+    [
+        "orders/orders_service/tracing.py",
+        "inventory/inventory_service/tracing.py",
+        "auth/auth_service/tracing.py",
+        "gateway/gateway/tracing.py",
+    ],
+    ["orders/orders_service/events.py", "inventory/inventory_service/events.py"],
+    [
+        "orders/orders_service/management/commands/relay_outbox.py",
+        "inventory/inventory_service/management/commands/relay_outbox.py",
+    ],
+]
+
+
+def drifted(group: list) -> list:
+    """(path, diff) for every copy that differs from the first file."""
+    first = (ROOT / group[0]).read_text().splitlines(keepends=True)
+    out = []
+    for path in group[1:]:
+        copy = (ROOT / path).read_text().splitlines(keepends=True)
+        if copy != first:
+            out.append(
+                (path, "".join(difflib.unified_diff(first, copy, group[0], path)))
+            )
+    return out
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fix", action="store_true", help="overwrite drifted copies")
+    args = parser.parse_args()
+    failed = False
+    for group in SHARED:
+        for path, diff in drifted(group):
+            if args.fix:
+                (ROOT / path).write_bytes((ROOT / group[0]).read_bytes())
+                print(f"updated {path} from {group[0]}")
+            else:
+                failed = True
+                sys.stdout.write(diff)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
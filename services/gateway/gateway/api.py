@@ -1,137 +1,258 @@
 import json
-import requests
+import math
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from ninja import NinjaAPI
 from ninja.errors import HttpError
+from prometheus_client import REGISTRY
 
+from . import checkout, resilience, tracing
 from .auth import JWTBearer
+from .compose import errors_of, fan_out, request_json
+from .idempotency import idempotent
+from .metrics import TimedJSONRenderer, timed
+from .proxy import proxy_request
+from .resilience import UpstreamUnavailable
+from .state_metrics import GatewayStateCollector
 
-api = NinjaAPI(title="Gateway API", version="1.0")
+api = NinjaAPI(title="Gateway API", version="1.0", renderer=TimedJSONRenderer())
+REGISTRY.register(GatewayStateCollector())
 
 AUTH = settings.AUTH_SERVICE_URL
 ORDERS = settings.ORDERS_SERVICE_URL
 INVENTORY = settings.INVENTORY_SERVICE_URL
 
 
-def _req(
-    method: str,
-    base: str,
-    path: str,
-    *,
-    json_data: dict = None,
-    params: dict = None,
-    headers: dict = None,
-):
-    url = f"{base.rstrip('/')}/api{path}"
-    h = headers or {}
-    try:
-        if method == "GET":
-            r = requests.get(url, params=params, headers=h, timeout=30)
-        elif method == "POST":
-            r = requests.post(url, json=json_data, params=params, headers=h, timeout=30)
-        elif method == "PATCH":
-            r = requests.patch(url, json=json_data, headers=h, timeout=30)
-        else:
-            raise HttpError(405, "Method not allowed")
-    except requests.RequestException as e:
-        raise HttpError(502, str(e))
-    if r.status_code >= 400:
-        raise HttpError(r.status_code, r.text or "Upstream error")
-    return r.json() if r.content else None
+@api.exception_handler(UpstreamUnavailable)
+def upstream_unavailable(request, exc: UpstreamUnavailable):
+    response = api.create_response(request, {"detail": str(exc)}, status=503)
+    response["Retry-After"] = str(max(1, math.ceil(exc.retry_after)))
+    return response
 
 
 @api.api_operation(["POST"], "/auth/register")
-def auth_register(request):
-    body = json.loads(request.body) if request.body else {}
-    return _req("POST", AUTH, "/register", json_data=body)
+async def auth_register(request):
+    return await proxy_request("POST", AUTH, "/register", request, pass_headers=False)
 
 
 @api.api_operation(["POST"], "/auth/login")
-def auth_login(request):
-    body = json.loads(request.body) if request.body else {}
-    return _req("POST", AUTH, "/login", json_data=body)
+async def auth_login(request):
+    return await proxy_request("POST", AUTH, "/login", request, pass_headers=False)
 
 
 @api.api_operation(["POST"], "/auth/refresh")
-def auth_refresh(request):
-    body = json.loads(request.body) if request.body else {}
-    return _req("POST", AUTH, "/refresh", json_data=body)
+async def auth_refresh(request):
+    return await proxy_request("POST", AUTH, "/refresh", request, pass_headers=False)
+
+
+# Client query parameters orders_list passes through; user_id always comes
+# from the token
+ORDERS_LIST_PARAMS = ("limit", "cursor", "include_items")
 
 
 @api.get("/orders", auth=JWTBearer())
-def orders_list(request):
-    user_id = request.auth
-    return _req("GET", ORDERS, "/orders", params={"user_id": user_id})
+async def orders_list(request):
+    params = {k: request.GET[k] for k in ORDERS_LIST_PARAMS if k in request.GET}
+    params["user_id"] = request.auth
+    return await proxy_request("GET", ORDERS, "/orders", request, params=params)
 
 
 @api.post("/orders", auth=JWTBearer())
-def orders_create(request):
+@idempotent
+async def orders_create(request):
     user_id = request.auth
     body = json.loads(request.body) if request.body else {}
     body["user_id"] = user_id
-    return _req("POST", ORDERS, "/orders", json_data=body)
+    # References are the checkout's key for finding its order; not client-set
+    body.pop("reference", None)
+    return await proxy_request(
+        "POST", ORDERS, "/orders", request, body=json.dumps(body).encode()
+    )
+
+
+@api.post("/orders/bulk", auth=JWTBearer())
+@idempotent
+async def orders_create_bulk(request):
+    user_id = request.auth
+    body = json.loads(request.body) if request.body else {}
+    orders = body.get("orders")
+    if not isinstance(orders, list):
+        raise HttpError(400, "orders list required")
+    for order in orders:
+        if isinstance(order, dict):
+            order["user_id"] = user_id
+            order.pop("reference", None)
+    return await proxy_request(
+        "POST", ORDERS, "/orders/bulk", request, body=json.dumps(body).encode()
+    )
 
 
 @api.get("/orders/{order_id}", auth=JWTBearer())
-def order_get(request, order_id: int):
-    return _req("GET", ORDERS, f"/orders/{order_id}")
+async def order_get(request, order_id: int, expand: str = ""):
+    if "stock" not in expand.split(","):
+        return await proxy_request("GET", ORDERS, f"/orders/{order_id}", request)
+    order = await request_json("GET", ORDERS, f"/orders/{order_id}")
+    product_ids = sorted({item["product_id"] for item in order["items"]})
+    results = await fan_out(
+        {
+            "stock": request_json(
+                "POST", INVENTORY, "/stock/lookup", json_data={"ids": product_ids}
+            )
+        }
+    )
+    lookup = results["stock"].data or {"found": []}
+    stock = {s["product_id"]: s for s in lookup["found"]}
+    for item in order["items"]:
+        item["stock"] = stock.get(item["product_id"])
+    order["errors"] = errors_of(results)
+    return order
 
 
 @api.patch("/orders/{order_id}", auth=JWTBearer())
-def order_update(request, order_id: int):
-    body = json.loads(request.body) if request.body else {}
-    return _req("PATCH", ORDERS, f"/orders/{order_id}", json_data=body)
+async def order_update(request, order_id: int):
+    return await proxy_request("PATCH", ORDERS, f"/orders/{order_id}", request)
 
 
 @api.get("/stock", auth=JWTBearer())
-def stock_list(request):
-    return _req("GET", INVENTORY, "/stock")
+async def stock_list(request):
+    return await proxy_request("GET", INVENTORY, "/stock", request, coalesce=True)
+
+
+@api.post("/stock/lookup", auth=JWTBearer())
+async def stock_lookup(request):
+    return await proxy_request("POST", INVENTORY, "/stock/lookup", request)
 
 
 @api.get("/stock/{product_id}", auth=JWTBearer())
-def stock_get(request, product_id: str):
-    return _req("GET", INVENTORY, f"/stock/{product_id}")
+async def stock_get(request, product_id: str):
+    return await proxy_request(
+        "GET", INVENTORY, f"/stock/{product_id}", request, coalesce=True
+    )
 
 
 @api.post("/stock", auth=JWTBearer())
-def stock_create(request):
-    body = json.loads(request.body) if request.body else {}
-    return _req("POST", INVENTORY, "/stock", json_data=body)
+async def stock_create(request):
+    return await proxy_request("POST", INVENTORY, "/stock", request)
 
 
 @api.post("/reserve", auth=JWTBearer())
-def reserve(request):
-    body = json.loads(request.body) if request.body else {}
-    return _req("POST", INVENTORY, "/reserve", json_data=body)
+@idempotent
+async def reserve(request):
+    return await proxy_request("POST", INVENTORY, "/reserve", request)
+
+
+@api.post("/reserve/batch", auth=JWTBearer())
+@idempotent
+async def reserve_batch(request):
+    return await proxy_request("POST", INVENTORY, "/reserve/batch", request)
 
 
 @api.post("/release", auth=JWTBearer())
-def release(request):
+@idempotent
+async def release(request):
     body = json.loads(request.body) if request.body else {}
     order_id = body.get("order_id")
     if not order_id:
         raise HttpError(400, "order_id required")
-    return _req("POST", INVENTORY, "/release", params={"order_id": order_id})
+    return await request_json(
+        "POST", INVENTORY, "/release", params={"order_id": order_id}
+    )
 
 
-@api.post("/orders/{order_id}/invoice", auth=JWTBearer())
-def order_invoice(request, order_id: int):
+@api.post("/checkout", auth=JWTBearer())
+@idempotent
+async def checkout_create(request):
+    """Create an order, reserve its items and confirm it in one request;
+    on failure the reservations are released and the order cancelled."""
+    body = json.loads(request.body) if request.body else {}
+    items = body.get("items")
+    if not isinstance(items, list) or not items:
+        raise HttpError(400, "items list required")
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get("product_id"), str):
+            raise HttpError(400, "every item needs a product_id")
+        quantity = item.get("quantity")
+        if not isinstance(quantity, int) or quantity <= 0:
+            raise HttpError(400, "quantity must be a positive integer")
+    result = await checkout.place(request.auth, items)
+    return api.create_response(
+        request, result.public(), status=checkout.http_status(result)
+    )
+
+
+@api.get("/checkout/{checkout_id}", auth=JWTBearer())
+async def checkout_get(request, checkout_id: str):
+    result = await checkout.load(checkout_id)
+    if result is None or result.user_id != request.auth:
+        raise HttpError(404, "Checkout not found")
+    return result.public()
+
+
+@api.get("/dashboard/summary", auth=JWTBearer())
+async def dashboard_summary(request):
+    order_params = {"user_id": request.auth}
+    if "days" in request.GET:
+        order_params["days"] = request.GET["days"]
+    stock_params = {}
+    if "low_stock_threshold" in request.GET:
+        stock_params["low_stock_threshold"] = request.GET["low_stock_threshold"]
+    results = await fan_out(
+        {
+            "orders": request_json(
+                "GET", ORDERS, "/orders/summary", params=order_params
+            ),
+            "stock": request_json(
+                "GET", INVENTORY, "/stock/summary", params=stock_params
+            ),
+        }
+    )
+    # Partial failure: the half that answered is still returned
+    return {
+        "orders": results["orders"].data,
+        "stock": results["stock"].data,
+        "errors": errors_of(results),
+    }
+
+
+def _invoke_invoice_lambda(order_id: int):
     try:
         import boto3
-
-        client = boto3.client("lambda", region_name=settings.AWS_REGION)
-        payload = json.dumps({"order_id": order_id})
-        resp = client.invoke(
-            FunctionName=settings.LAMBDA_INVOICE_FUNCTION,
-            InvocationType="RequestResponse",
-            Payload=payload,
-        )
-        result = json.loads(resp["Payload"].read().decode())
+        from botocore.config import Config
+
+        with resilience.guard("lambda").call() as call, timed("upstream.lambda"):
+            with tracing.span("upstream.lambda", order_id=order_id):
+                client = boto3.client(
+                    "lambda",
+                    region_name=settings.AWS_REGION,
+                    config=Config(
+                        connect_timeout=settings.UPSTREAM_CONNECT_TIMEOUT,
+                        read_timeout=call.timeout,
+                        retries={"max_attempts": 0},
+                    ),
+                )
+                # Lambda has no HTTP headers to carry the trace context
+                payload = json.dumps(
+                    {"order_id": order_id, "traceparent": tracing.traceparent()}
+                )
+                resp = client.invoke(
+                    FunctionName=settings.LAMBDA_INVOICE_FUNCTION,
+                    InvocationType="RequestResponse",
+                    Payload=payload,
+                )
+                result = json.loads(resp["Payload"].read().decode())
+                call.status(500 if resp.get("FunctionError") else 200)
         if result.get("statusCode", 200) >= 400:
             raise HttpError(result["statusCode"], result.get("body", "Lambda error"))
         body = result.get("body", "{}")
         return json.loads(body) if isinstance(body, str) else body
-    except HttpError:
+    except (HttpError, UpstreamUnavailable):
         raise
     except Exception as e:
         raise HttpError(502, f"Lambda invocation failed: {e}")
+
+
+@api.post("/orders/{order_id}/invoice", auth=JWTBearer())
+async def order_invoice(request, order_id: int):
+    # boto3 is blocking; run it off the event loop
+    return await sync_to_async(_invoke_invoice_lambda, thread_sensitive=False)(order_id)
@@ -2,11 +2,13 @@ import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
-from gateway import routing as gateway_routing
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "gateway.settings")
 django_asgi = get_asgi_application()
 
+# Consumers read settings at import time, so Django must be set up first
+from gateway import routing as gateway_routing  # noqa: E402
+
 application = ProtocolTypeRouter(
     {
         "http": django_asgi,
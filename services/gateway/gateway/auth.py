@@ -1,45 +1,172 @@
+import hashlib
 import logging
+import time
 from typing import Optional
 
+import jwt
 import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from ninja.security import HttpBearer
 
+from . import upstream
+from .cache import MISSING, TTLCache
+from .metrics import timed
+from .resilience import UpstreamUnavailable
+
 logger = logging.getLogger(__name__)
 
+# Same leeway as the auth service uses when it decodes tokens
+JWT_LEEWAY_SECONDS = 15
+
 
+@timed("auth_service_verify")
 def _verify_token_with_auth_service(token: str) -> Optional[int]:
-    """Validate access token via auth service. Returns user_id or None."""
+    """Validate access token via auth service. Returns user_id, or None if the
+    token is rejected; raises UpstreamUnavailable if no answer was had."""
     auth_url = getattr(settings, "AUTH_SERVICE_URL", "").rstrip("/")
     if not auth_url:
         logger.warning("AUTH_SERVICE_URL not set")
         return None
     try:
-        resp = requests.post(
-            f"{auth_url}/api/verify",
+        resp = upstream.request(
+            "POST",
+            auth_url,
+            "/verify",
             json={"access": token},
-            timeout=5,
+            timeout=(settings.UPSTREAM_CONNECT_TIMEOUT, 5),
             headers={"Content-Type": "application/json"},
         )
-        if resp.status_code != 200:
-            logger.warning(
-                "Auth verify returned %s: %s", resp.status_code, resp.text[:200]
-            )
-            return None
-        data = resp.json()
-        user_id = data.get("user_id")
-        return user_id if user_id is not None else None
     except requests.RequestException as e:
         logger.warning("Auth verify request failed: %s", e)
+        raise UpstreamUnavailable("auth", "token verification failed", 1) from e
+    if resp.status_code >= 500:
+        logger.warning("Auth verify returned %s", resp.status_code)
+        raise UpstreamUnavailable("auth", f"verify returned {resp.status_code}", 1)
+    if resp.status_code != 200:
+        logger.warning("Auth verify returned %s: %s", resp.status_code, resp.text[:200])
         return None
+    return resp.json().get("user_id")
+
+
+def _decode_access_token(token: str) -> Optional[int]:
+    """Check signature, exp and type in-process. Returns user_id or None."""
+    try:
+        payload = jwt.decode(
+            token,
+            settings.JWT_SECRET_KEY,
+            algorithms=[settings.JWT_ALGORITHM],
+            leeway=JWT_LEEWAY_SECONDS,
+        )
+    except jwt.PyJWTError as e:
+        logger.info("Local JWT verify failed: %s", type(e).__name__)
+        return None
+    if payload.get("type") != "access":
+        return None
+    try:
+        return int(payload.get("sub"))
+    except (TypeError, ValueError):
+        return None
+
+
+_user_check_cache = TTLCache(getattr(settings, "JWT_USER_CACHE_SIZE", 10000))
+token_cache = TTLCache(getattr(settings, "JWT_CACHE_SIZE", 10000))
+
+
+def _verify_token_locally(token: str) -> Optional[int]:
+    """Validate access token in-process, optionally confirming the user still
+    exists with the auth service (cached for JWT_USER_CHECK_TTL seconds)."""
+    user_id = _decode_access_token(token)
+    if user_id is None:
+        return None
+    ttl = getattr(settings, "JWT_USER_CHECK_TTL", 0)
+    if ttl <= 0 or _user_check_cache.get(user_id) is not MISSING:
+        return user_id
+    # Only positive answers are cached: a rejection must take effect at once.
+    # An unreachable auth service raises UpstreamUnavailable instead.
+    if _verify_token_with_auth_service(token) != user_id:
+        return None
+    _user_check_cache.set(user_id, True, ttl)
+    return user_id
+
+
+def _cache_ttl(token: str, user_id: Optional[int]) -> float:
+    """Positive results live until the earlier of exp and JWT_CACHE_TTL;
+    negative results only briefly, to absorb floods of bad tokens."""
+    if user_id is None:
+        return getattr(settings, "JWT_NEGATIVE_CACHE_TTL", 5)
+    ttl = getattr(settings, "JWT_CACHE_TTL", 300)
+    try:
+        claims = jwt.decode(token, options={"verify_signature": False})
+        exp = float(claims["exp"])
+    except (jwt.PyJWTError, KeyError, TypeError, ValueError):
+        return ttl
+    return min(ttl, exp - time.time())
+
+
+def _token_key(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+
+def _needs_auth_service() -> bool:
+    if getattr(settings, "JWT_VERIFY_MODE", "local") == "remote":
+        return True
+    return getattr(settings, "JWT_USER_CHECK_TTL", 0) > 0
+
+
+@timed("token_verify")
+def _verify_and_cache(key: bytes, token: str) -> Optional[int]:
+    # UpstreamUnavailable propagates uncached (503), so an auth outage does
+    # not leave valid tokens rejected once it is over
+    if getattr(settings, "JWT_VERIFY_MODE", "local") == "remote":
+        user_id = _verify_token_with_auth_service(token)
+    else:
+        user_id = _verify_token_locally(token)
+    token_cache.set(key, user_id, _cache_ttl(token, user_id))
+    return user_id
+
+
+def verify_token(token: str) -> Optional[int]:
+    """Validate access token using JWT_VERIFY_MODE. Returns user_id or None."""
+    key = _token_key(token)
+    cached = token_cache.get(key)
+    if cached is not MISSING:
+        return cached
+    return _verify_and_cache(key, token)
+
+
+async def averify_token(token: str) -> Optional[int]:
+    """Async verify_token: only leaves the event loop when the auth service
+    may have to be called."""
+    key = _token_key(token)
+    cached = token_cache.get(key)
+    if cached is not MISSING:
+        return cached
+    if _needs_auth_service():
+        return await sync_to_async(_verify_and_cache, thread_sensitive=False)(
+            key, token
+        )
+    return _verify_and_cache(key, token)
 
 
 class JWTBearer(HttpBearer):
+    async def __call__(self, request):
+        auth_value = request.headers.get(self.header)
+        if not auth_value:
+            return None
+        scheme, _, token = auth_value.partition(" ")
+        if scheme.lower() != self.openapi_scheme:
+            return None
+        token = token.strip()
+        if not token:
+            return None
+        return await averify_token(token)
+
     def authenticate(self, request, token):
         if not token:
             return None
         token = token.strip()
-        return _verify_token_with_auth_service(token)
+        return verify_token(token)
 
 
 def get_user_id_from_token(request):
@@ -47,4 +174,4 @@ def get_user_id_from_token(request):
     if not auth or not auth.startswith("Bearer "):
         return None
     token = auth[7:].strip()
-    return _verify_token_with_auth_service(token)
+    return verify_token(token)
@@ -0,0 +1,274 @@
+import asyncio
+import json
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+from django.conf import settings
+
+from .compose import CallResult, fan_out, request_json
+from .store import PREFIX, get_store
+
+# Until RESERVED a failure is compensated (release, then cancel the order);
+# from RESERVED on the order is only ever driven forward to confirmed
+STARTED = "started"
+ORDER_CREATED = "order_created"
+RESERVED = "reserved"
+COMPENSATING = "compensating"
+CONFIRMED = "confirmed"
+FAILED = "failed"
+FINISHED = (CONFIRMED, FAILED)
+
+# Outcomes that do not tell whether the upstream applied the call
+_UNKNOWN_OUTCOME = (502, 504)
+
+
+@dataclass
+class Checkout:
+    id: str
+    user_id: int
+    items: list
+    state: str = STARTED
+    order_id: Optional[int] = None
+    order: Optional[dict] = None
+    errors: dict = field(default_factory=dict)
+    # A reservation may still land after the first release; release again
+    recheck: bool = False
+    updated_at: float = 0.0
+
+    def public(self) -> dict:
+        return {
+            "checkout_id": self.id,
+            "status": self.state,
+            "order_id": self.order_id,
+            "order": self.order,
+            "errors": self.errors,
+        }
+
+
+def _key(checkout_id: str) -> str:
+    return f"{PREFIX}checkout:{checkout_id}"
+
+
+def _pending_key(checkout_id: str) -> str:
+    return f"{PREFIX}checkout-pending:{checkout_id}"
+
+
+async def save(checkout: Checkout) -> None:
+    """Persist progress before the next step, so a checkout interrupted at
+    any point can be resumed or compensated by recover_stale()."""
+    store = get_store()
+    checkout.updated_at = time.time()
+    ttl = settings.CHECKOUT_TTL
+    await store.set(_key(checkout.id), json.dumps(asdict(checkout)), ttl)
+    if checkout.state in FINISHED:
+        await store.delete(_pending_key(checkout.id))
+    else:
+        await store.set(_pending_key(checkout.id), checkout.id, ttl)
+
+
+async def load(checkout_id: str) -> Optional[Checkout]:
+    raw = await get_store().get(_key(checkout_id))
+    return Checkout(**json.loads(raw)) if raw else None
+
+
+async def _call(name: str, coro) -> CallResult:
+    return (await fan_out({name: coro}))[name]
+
+
+def _error(result: CallResult) -> dict:
+    return {"status": result.status, "detail": result.error}
+
+
+def _set_status(checkout: Checkout, status: str):
+    return request_json(
+        "PATCH",
+        settings.ORDERS_SERVICE_URL,
+        f"/orders/{checkout.order_id}",
+        json_data={"status": status},
+    )
+
+
+async def _reserve(checkout: Checkout) -> dict:
+    """Reserve every product concurrently; returns failures by product."""
+    wanted = defaultdict(int)
+    for item in checkout.items:
+        wanted[item["product_id"]] += item["quantity"]
+    results = await fan_out(
+        {
+            product_id: request_json(
+                "POST",
+                settings.INVENTORY_SERVICE_URL,
+                "/reserve",
+                json_data={
+                    "product_id": product_id,
+                    "order_id": str(checkout.order_id),
+                    "quantity": quantity,
+                },
+            )
+            for product_id, quantity in wanted.items()
+        }
+    )
+    errors = {}
+    for product_id, result in results.items():
+        if not result.ok:
+            errors[product_id] = _error(result)
+        elif not result.data.get("success"):
+            errors[product_id] = {"status": 409, "detail": result.data.get("message")}
+    return errors
+
+
+async def _compensate(checkout: Checkout) -> None:
+    # Releasing by order id frees whatever did get reserved, and is idempotent
+    release = await _call(
+        "release",
+        request_json(
+            "POST",
+            settings.INVENTORY_SERVICE_URL,
+            "/release",
+            params={"order_id": str(checkout.order_id)},
+        ),
+    )
+    if not release.ok:
+        return
+    cancel = await _call("cancel", _set_status(checkout, "cancelled"))
+    if not cancel.ok:
+        return
+    checkout.order = cancel.data
+    if checkout.recheck:
+        checkout.recheck = False
+    else:
+        checkout.state = FAILED
+    await save(checkout)
+
+
+async def drive(checkout: Checkout) -> Checkout:
+    """Advance a checkout as far as the upstreams allow. A step that cannot
+    complete leaves it pending for recover_stale()."""
+    if checkout.state == STARTED:
+        result = await _call(
+            "order",
+            request_json(
+                "POST",
+                settings.ORDERS_SERVICE_URL,
+                "/orders",
+                json_data={
+                    "user_id": checkout.user_id,
+                    "items": checkout.items,
+                    # Lets recovery find the order if this response is lost
+                    "reference": checkout.id,
+                },
+            ),
+        )
+        if not result.ok:
+            checkout.errors = {"order": _error(result)}
+            if result.status not in _UNKNOWN_OUTCOME:
+                checkout.state = FAILED
+            # Otherwise the order may exist; recovery looks it up and cancels it
+            await save(checkout)
+            return checkout
+        checkout.order = result.data
+        checkout.order_id = result.data["id"]
+        checkout.state = ORDER_CREATED
+        await save(checkout)
+    if checkout.state == ORDER_CREATED:
+        errors = await _reserve(checkout)
+        if errors:
+            checkout.errors = errors
+            checkout.recheck = any(
+                e["status"] in _UNKNOWN_OUTCOME for e in errors.values()
+            )
+            checkout.state = COMPENSATING
+        else:
+            checkout.state = RESERVED
+        await save(checkout)
+    if checkout.state == RESERVED:
+        result = await _call("confirm", _set_status(checkout, "confirmed"))
+        if result.ok:
+            checkout.order = result.data
+            checkout.state = CONFIRMED
+            await save(checkout)
+    elif checkout.state == COMPENSATING:
+        await _compensate(checkout)
+    return checkout
+
+
+async def place(user_id: int, items: list) -> Checkout:
+    """Create the order, reserve its items and confirm it, or undo what was
+    done. Runs as its own task so a client disconnecting mid-way does not
+    abandon the checkout."""
+    checkout = Checkout(id=uuid.uuid4().hex, user_id=user_id, items=items)
+    await save(checkout)
+    return await asyncio.shield(asyncio.ensure_future(drive(checkout)))
+
+
+def http_status(checkout: Checkout) -> int:
+    if checkout.state == CONFIRMED:
+        return 200
+    if checkout.state == RESERVED:
+        return 202
+    statuses = [e["status"] or 502 for e in checkout.errors.values()]
+    client_errors = [s for s in statuses if 400 <= s < 500]
+    if client_errors:
+        return client_errors[0]
+    return 503 if 503 in statuses else 502
+
+
+async def _find_order(checkout: Checkout) -> Optional[dict]:
+    found = await request_json(
+        "GET",
+        settings.ORDERS_SERVICE_URL,
+        "/orders",
+        params={"user_id": checkout.user_id, "reference": checkout.id},
+    )
+    return found[0] if found else None
+
+
+async def recover(checkout: Checkout) -> Checkout:
+    if checkout.state == STARTED:
+        # The create may or may not have landed; look the order up by the
+        # checkout's reference. Lookup failures leave it for the next pass.
+        result = await _call("order", _find_order(checkout))
+        if not result.ok:
+            return checkout
+        if result.data is None:
+            checkout.state = FAILED
+            checkout.errors = {
+                "checkout": {"status": None, "detail": "Interrupted before the order"}
+            }
+            await save(checkout)
+            return checkout
+        checkout.order = result.data
+        checkout.order_id = result.data["id"]
+        checkout.state = ORDER_CREATED
+    if checkout.state == ORDER_CREATED:
+        # Reservations may have been in flight when the gateway stopped
+        checkout.state = COMPENSATING
+        checkout.errors = checkout.errors or {
+            "checkout": {"status": None, "detail": "Interrupted while reserving"}
+        }
+        await save(checkout)
+    return await drive(checkout)
+
+
+async def recover_stale(older_than: float) -> int:
+    """Resume or compensate checkouts nobody has touched for `older_than`
+    seconds. Each is claimed first, so several recoverers can run at once.
+    Returns how many were picked up."""
+    store = get_store()
+    recovered = 0
+    for key in await store.keys(f"{PREFIX}checkout-pending:"):
+        checkout = await load(key.rsplit(":", 1)[1])
+        if checkout is None or checkout.state in FINISHED:
+            await store.delete(key)
+            continue
+        if time.time() - checkout.updated_at < older_than:
+            continue
+        claim = f"{PREFIX}checkout-claim:{checkout.id}"
+        if not await store.set(claim, "1", older_than, nx=True):
+            continue
+        await recover(checkout)
+        recovered += 1
+    return recovered
@@ -0,0 +1,89 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Awaitable, Dict, Optional
+
+import httpx
+
+from django.conf import settings
+from ninja.errors import HttpError
+
+from . import upstream
+from .resilience import UpstreamUnavailable
+
+
+async def request_json(
+    method: str,
+    base: str,
+    path: str,
+    *,
+    json_data: dict = None,
+    params: dict = None,
+    headers: dict = None,
+):
+    """Call an upstream and return its decoded JSON body; upstream errors
+    and transport failures are raised as HttpError."""
+    h = headers or {}
+    if method not in ("GET", "POST", "PATCH"):
+        raise HttpError(405, "Method not allowed")
+    try:
+        r = await upstream.arequest(
+            method,
+            base,
+            path,
+            json=json_data if method != "GET" else None,
+            params=params,
+            headers=h,
+        )
+    except httpx.RequestError as e:
+        raise HttpError(502, str(e))
+    if r.status_code >= 400:
+        raise HttpError(r.status_code, _upstream_detail(r))
+    return r.json() if r.content else None
+
+
+def _upstream_detail(r: httpx.Response) -> str:
+    try:
+        detail = r.json().get("detail")
+    except (ValueError, AttributeError):
+        detail = None
+    return str(detail) if detail else r.text or "Upstream error"
+
+
+@dataclass
+class CallResult:
+    ok: bool
+    data: Any = None
+    status: Optional[int] = None
+    error: Optional[str] = None
+
+
+async def _run(call: Awaitable, timeout: float) -> CallResult:
+    try:
+        return CallResult(ok=True, data=await asyncio.wait_for(call, timeout))
+    except asyncio.TimeoutError:
+        return CallResult(ok=False, status=504, error="Upstream call timed out")
+    except HttpError as e:
+        return CallResult(ok=False, status=e.status_code, error=str(e))
+    except UpstreamUnavailable as e:
+        return CallResult(ok=False, status=503, error=str(e))
+
+
+async def fan_out(
+    calls: Dict[str, Awaitable], timeout: Optional[float] = None
+) -> Dict[str, CallResult]:
+    """Await upstream calls concurrently, each bounded by `timeout` seconds.
+    A call that fails or times out yields a failed CallResult instead of
+    cancelling the others."""
+    if timeout is None:
+        timeout = settings.COMPOSE_CALL_TIMEOUT
+    names = list(calls)
+    results = await asyncio.gather(*(_run(calls[n], timeout) for n in names))
+    return dict(zip(names, results))
+
+
+def errors_of(results: Dict[str, CallResult]) -> Dict[str, dict]:
+    return {
+        name: {"status": r.status, "detail": r.error}
+        for name, r in results.items()
+        if not r.ok
+    }
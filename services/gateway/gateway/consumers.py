@@ -1,14 +1,137 @@
+import asyncio
 import json
+import logging
+from urllib.parse import parse_qs
+
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+
+from .auth import averify_token
+from .notifications import stock_group, user_group
+from .resilience import UpstreamUnavailable
+
+logger = logging.getLogger(__name__)
+
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_TOO_SLOW = 4408
+CLOSE_TRY_AGAIN = 1013
+
+
+def _token(scope) -> str:
+    """Browsers cannot set headers on a WebSocket, so ?token= is accepted
+    alongside an Authorization: Bearer header."""
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer":
+                return token.strip()
+    query = parse_qs(scope.get("query_string", b"").decode())
+    return query.get("token", [""])[0]
 
 
 class NotificationConsumer(AsyncWebsocketConsumer):
+    """Authenticated socket in its own `user.<id>` group, plus `stock.<id>`
+    groups it subscribes to. Events are queued per connection and sent in
+    batched frames; a client that falls behind is disconnected."""
+
     async def connect(self):
-        await self.channel_layer.group_add("notifications", self.channel_name)
+        self.joined = set()
+        self.queue = None
+        self.sender = None
+        token = _token(self.scope)
+        try:
+            user_id = await averify_token(token) if token else None
+        except UpstreamUnavailable:
+            await self.accept()
+            await self.close(code=CLOSE_TRY_AGAIN)
+            return
+        if user_id is None:
+            # Accept first so the client sees why it was closed
+            await self.accept()
+            await self.close(code=CLOSE_UNAUTHORIZED)
+            return
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_SIZE)
         await self.accept()
+        await self._join(user_group(user_id))
+        self.sender = asyncio.ensure_future(self._send_batches())
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard("notifications", self.channel_name)
+        if self.sender is not None:
+            self.sender.cancel()
+        for group in self.joined:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        self.joined.clear()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        """{"action": "subscribe" | "unsubscribe", "products": [...]}"""
+        try:
+            data = json.loads(text_data or "")
+            action, products = data["action"], data["products"]
+        except (ValueError, TypeError, KeyError):
+            return
+        if not isinstance(products, list):
+            return
+        groups = [stock_group(str(p)) for p in products]
+        if action == "subscribe":
+            for group in groups:
+                if group in self.joined:
+                    continue
+                # joined also holds the connection's own user group
+                if len(self.joined) - 1 >= settings.WS_MAX_SUBSCRIPTIONS:
+                    break
+                await self._join(group)
+        elif action == "unsubscribe":
+            for group in groups:
+                if group in self.joined:
+                    self.joined.discard(group)
+                    await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def _join(self, group: str) -> None:
+        if group not in self.joined:
+            self.joined.add(group)
+            await self.channel_layer.group_add(group, self.channel_name)
 
     async def notification_message(self, event):
-        await self.send(text_data=json.dumps(event["message"]))
+        # Only enqueue here so the channel layer is never waiting on a socket
+        if self.queue is None:
+            return
+        try:
+            self.queue.put_nowait(event["message"])
+        except asyncio.QueueFull:
+            logger.info("Dropping slow WebSocket consumer for user %s", self.user_id)
+            self.queue = None
+            await self.close(code=CLOSE_TOO_SLOW)
+
+    async def _send_batches(self):
+        """Wait for an event, gather whatever else arrives within
+        WS_BATCH_WINDOW seconds, and send it all as one frame. Events that
+        carry the same "key" are coalesced to the latest."""
+        queue = self.queue
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = {}
+            message = await queue.get()
+            deadline = loop.time() + settings.WS_BATCH_WINDOW
+            while True:
+                key = message.get("key") or len(batch)
+                # A replaced snapshot moves to the end, after earlier deltas
+                batch.pop(key, None)
+                batch[key] = message
+                if len(batch) >= settings.WS_BATCH_MAX:
+                    break
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    message = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            frame = json.dumps({"events": list(batch.values())})
+            try:
+                await asyncio.wait_for(
+                    self.send(text_data=frame), settings.WS_SEND_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                await self.close(code=CLOSE_TOO_SLOW)
+                return
@@ -0,0 +1,94 @@
+import json
+import logging
+from collections import deque
+from functools import partial
+
+from .cache import MISSING, TTLCache
+from .notifications import relay
+
+logger = logging.getLogger(__name__)
+
+EXCHANGE = "soa.events"
+# Outboxes deliver at least once; remember recent event ids to drop repeats
+SEEN_TTL = 3600
+SEEN_MAX = 100000
+
+
+class MemorySource:
+    """In-process stand-in for the RabbitMQ queue (RABBITMQ_URL=memory://).
+    send() matches the publishers' broker interface, so tests can feed it
+    exactly what an outbox relay would publish."""
+
+    def __init__(self):
+        self.pending: deque = deque()
+
+    def send(self, routing_key: str, body: bytes, message_id: str) -> None:
+        self.pending.append(body)
+
+    def messages(self):
+        """(body, ack) pairs until nothing is pending."""
+        while self.pending:
+            yield self.pending.popleft(), lambda: None
+
+    def close(self) -> None:
+        pass
+
+
+memory_source = MemorySource()
+
+
+class _RabbitMQSource:
+    """Durable queue bound to every event on the exchange."""
+
+    def __init__(self, url: str, queue: str, prefetch: int):
+        import pika
+
+        self.queue = queue
+        self.connection = pika.BlockingConnection(pika.URLParameters(url))
+        self.channel = self.connection.channel()
+        self.channel.exchange_declare(EXCHANGE, exchange_type="topic", durable=True)
+        self.channel.queue_declare(queue, durable=True)
+        self.channel.queue_bind(queue, EXCHANGE, routing_key="#")
+        self.channel.basic_qos(prefetch_count=prefetch)
+
+    def messages(self):
+        for method, properties, body in self.channel.consume(self.queue):
+            yield body, partial(self.channel.basic_ack, method.delivery_tag)
+
+    def close(self) -> None:
+        if self.connection.is_open:
+            self.connection.close()
+
+
+def connect(url: str, queue: str, prefetch: int):
+    if url.startswith("memory://"):
+        return memory_source
+    return _RabbitMQSource(url, queue, prefetch)
+
+
+class EventRelay:
+    """Turns published event messages into WebSocket notifications, dropping
+    events it has already relayed."""
+
+    def __init__(self):
+        self.seen = TTLCache(SEEN_MAX)
+
+    async def handle(self, body: bytes) -> int:
+        """Relay one message; returns the number of group sends."""
+        try:
+            events = json.loads(body)["events"]
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Dropping malformed event message")
+            return 0
+        return await relay(self._unseen(events))
+
+    def _unseen(self, events: list) -> list:
+        fresh = []
+        for event in events:
+            event_id = event.get("event_id")
+            if event_id is not None:
+                if self.seen.get(event_id) is not MISSING:
+                    continue
+                self.seen.set(event_id, True, SEEN_TTL)
+            fresh.append(event)
+        return fresh
@@ -0,0 +1,178 @@
+import asyncio
+import base64
+import functools
+import hashlib
+import json
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from ninja.errors import HttpError
+from ninja.responses import NinjaJSONEncoder
+
+from .store import PREFIX, get_store
+
+HEADER = "Idempotency-Key"
+# Response headers kept with a stored result; the body is stored as sent
+STORED_HEADERS = ("Content-Encoding", "ETag", "Cache-Control")
+PENDING = "pending"
+DONE = "done"
+
+
+def _store_key(request, key: str) -> str:
+    scope = f"{request.auth}:{request.path}:{key}"
+    return f"{PREFIX}idem:{hashlib.sha256(scope.encode()).hexdigest()}"
+
+
+def _fingerprint(request) -> str:
+    digest = hashlib.sha256(request.method.encode())
+    digest.update(request.get_full_path().encode())
+    digest.update(b"\0")
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+async def _buffer(response) -> HttpResponse:
+    """Read a streamed proxy response so it can be both stored and sent."""
+    if not isinstance(response, StreamingHttpResponse):
+        return response
+    chunks = [chunk async for chunk in response.streaming_content]
+    buffered = HttpResponse(
+        b"".join(chunks),
+        status=response.status_code,
+        content_type=response["Content-Type"],
+    )
+    for name in STORED_HEADERS:
+        if response.has_header(name):
+            buffered[name] = response[name]
+    return buffered
+
+
+def _result(fingerprint: str, status: int, body: bytes, headers: dict) -> str:
+    # Bodies over IDEMPOTENCY_MAX_BODY are dropped but the outcome is kept,
+    # so a retry is still answered instead of running the request again
+    kept = len(body) <= settings.IDEMPOTENCY_MAX_BODY
+    return json.dumps(
+        {
+            "state": DONE,
+            "fingerprint": fingerprint,
+            "status": status,
+            "headers": headers,
+            "body": base64.b64encode(body).decode() if kept else None,
+        }
+    )
+
+
+def _replay(entry: dict) -> HttpResponse:
+    if entry["body"] is None:
+        response = HttpResponse(
+            json.dumps(
+                {
+                    "detail": "This request was already processed; its response "
+                    "was too large to keep",
+                    "status": entry["status"],
+                }
+            ),
+            status=409,
+            content_type="application/json",
+        )
+        response["Idempotent-Replayed"] = "true"
+        return response
+    headers = entry["headers"]
+    response = HttpResponse(
+        base64.b64decode(entry["body"]),
+        status=entry["status"],
+        content_type=headers.pop("Content-Type", "application/json"),
+    )
+    for name, value in headers.items():
+        response[name] = value
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+async def _execute(view, request, args, kwargs, store_key: str, fingerprint: str):
+    """Run the view as the owner of the key. A result under 500 is kept for
+    IDEMPOTENCY_TTL; anything else frees the key so a retry runs again."""
+    store = get_store("idempotency")
+    try:
+        response = await view(request, *args, **kwargs)
+    except HttpError as e:
+        if e.status_code < 500:
+            body = json.dumps({"detail": str(e)}).encode()
+            headers = {"Content-Type": "application/json"}
+            await store.set(
+                store_key,
+                _result(fingerprint, e.status_code, body, headers),
+                settings.IDEMPOTENCY_TTL,
+            )
+        else:
+            await store.delete(store_key)
+        raise
+    except BaseException:
+        await store.delete(store_key)
+        raise
+    if isinstance(response, (HttpResponse, StreamingHttpResponse)):
+        response = await _buffer(response)
+        status, body = response.status_code, response.content
+        headers = {"Content-Type": response["Content-Type"]}
+        headers.update(
+            (n, response[n]) for n in STORED_HEADERS if response.has_header(n)
+        )
+    else:
+        status = 200
+        body = json.dumps(response, cls=NinjaJSONEncoder).encode()
+        headers = {"Content-Type": "application/json; charset=utf-8"}
+    if status >= 500:
+        await store.delete(store_key)
+    else:
+        await store.set(
+            store_key,
+            _result(fingerprint, status, body, headers),
+            settings.IDEMPOTENCY_TTL,
+        )
+    return response
+
+
+def idempotent(view):
+    """Honour an Idempotency-Key header on a mutating route. Keys are scoped
+    to the user and route. The first request runs; concurrent duplicates
+    wait for its result, and later ones get the stored response back until
+    it expires. Reusing a key for a different request is rejected."""
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return await view(request, *args, **kwargs)
+        if not key or len(key) > 255:
+            raise HttpError(400, f"{HEADER} must be 1-255 characters")
+        store = get_store("idempotency")
+        store_key = _store_key(request, key)
+        fingerprint = _fingerprint(request)
+        pending = json.dumps({"state": PENDING, "fingerprint": fingerprint})
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.IDEMPOTENCY_WAIT
+        delay = 0.02
+        while True:
+            if await store.set(
+                store_key, pending, settings.IDEMPOTENCY_LOCK_TTL, nx=True
+            ):
+                # Its own task, so a client hanging up cannot leave the key
+                # claimed with the work half done
+                task = asyncio.ensure_future(
+                    _execute(view, request, args, kwargs, store_key, fingerprint)
+                )
+                return await asyncio.shield(task)
+            raw = await store.get(store_key)
+            if raw is None:
+                continue  # the owner failed and freed the key; claim it
+            entry = json.loads(raw)
+            if entry["fingerprint"] != fingerprint:
+                raise HttpError(422, f"{HEADER} was used for a different request")
+            if entry["state"] == DONE:
+                return _replay(entry)
+            if loop.time() >= deadline:
+                raise HttpError(409, "A request with this key is still in progress")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.25)
+
+    return wrapper
@@ -0,0 +1,34 @@
+import asyncio
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from gateway.checkout import recover_stale
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Finish or compensate checkouts a gateway left half done"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="one pass and exit")
+
+    def handle(self, *args, **options):
+        if not settings.REDIS_URL:
+            # The in-process store is only visible to the gateway that owns it
+            raise CommandError("REDIS_URL is not set")
+        asyncio.run(self._run(options["once"]))
+
+    async def _run(self, once: bool) -> None:
+        while True:
+            try:
+                recovered = await recover_stale(settings.CHECKOUT_RECOVER_AFTER)
+                if recovered:
+                    logger.info("Recovered %d checkouts", recovered)
+            except Exception as e:
+                logger.warning("Checkout recovery failed: %s", e)
+            if once:
+                return
+            await asyncio.sleep(settings.CHECKOUT_RECOVER_INTERVAL)
@@ -0,0 +1,51 @@
+import asyncio
+import logging
+import time
+
+import pika
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from gateway.events import EventRelay, connect
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Relay order and stock events from RabbitMQ to WebSocket groups"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--queue", default="gateway.notifications")
+        parser.add_argument("--prefetch", type=int, default=50)
+        parser.add_argument(
+            "--once", action="store_true", help="stop when the queue is drained"
+        )
+
+    def handle(self, *args, **options):
+        # One loop for the whole run so the channel layer keeps its connections
+        loop = asyncio.new_event_loop()
+        event_relay = EventRelay()
+        failures = 0
+        while True:
+            try:
+                source = connect(
+                    settings.RABBITMQ_URL, options["queue"], options["prefetch"]
+                )
+                try:
+                    self.stdout.write(f"Relaying events via {options['queue']}")
+                    for body, ack in source.messages():
+                        loop.run_until_complete(event_relay.handle(body))
+                        # Ack after the hand-off: a crash redelivers the batch
+                        ack()
+                finally:
+                    source.close()
+            except pika.exceptions.AMQPError as e:
+                failures += 1
+                logger.warning("RabbitMQ connection lost: %s", e)
+                time.sleep(min(30, 0.5 * 2 ** min(failures, 6)))
+                continue
+            failures = 0
+            # Only the in-memory source runs dry
+            if options["once"]:
+                return
+            time.sleep(0.2)
@@ -0,0 +1,57 @@
+import hashlib
+import re
+
+from channels.layers import get_channel_layer
+
+# Channels only accepts these characters in group names, up to 100 of them
+_GROUP_SAFE = re.compile(r"^[A-Za-z0-9_.\-]{1,80}$")
+
+
+def user_group(user_id: int) -> str:
+    return f"user.{int(user_id)}"
+
+
+def stock_group(product_id: str) -> str:
+    if _GROUP_SAFE.match(product_id):
+        return f"stock.{product_id}"
+    return f"stock.h-{hashlib.sha1(product_id.encode()).hexdigest()[:20]}"
+
+
+async def notify(group: str, message: dict) -> None:
+    """Deliver `message` to every socket in `group`. Messages sharing a "key"
+    within one batching window reach the client once, latest wins."""
+    await get_channel_layer().group_send(
+        group, {"type": "notification.message", "message": message}
+    )
+
+
+def groups_for(event: dict) -> list:
+    """Groups a domain event from orders or inventory is delivered to."""
+    kind = event.get("type", "")
+    if kind.startswith("order.") and event.get("user_id") is not None:
+        return [user_group(event["user_id"])]
+    if kind.startswith("stock.") and event.get("product_id"):
+        return [stock_group(str(event["product_id"]))]
+    return []
+
+
+def _coalesce_key(event: dict):
+    # Only snapshots may replace each other; reserved/released are deltas
+    if event.get("type") == "stock.updated":
+        return f"stock.{event['product_id']}"
+    if event.get("type") == "order.status_changed":
+        return f"order.{event.get('order_id')}"
+    return None
+
+
+async def relay(events: list) -> int:
+    """Send each event to its groups, in order so a client never sees a
+    later status before an earlier one. Returns the number of group sends."""
+    sent = 0
+    for event in events:
+        key = _coalesce_key(event)
+        message = dict(event, key=key) if key else event
+        for group in groups_for(event):
+            await notify(group, message)
+            sent += 1
+    return sent
@@ -1,51 +1,106 @@
 import json
-import requests
-from django.conf import settings
-from django.http import HttpResponse
 
+import httpx
+from django.http import HttpResponse, StreamingHttpResponse
 
-def proxy_request(
+from . import upstream
+
+# Client request headers forwarded upstream when pass_headers is set
+PASSTHROUGH_REQUEST_HEADERS = ("Authorization", "Content-Type", "If-None-Match")
+# Upstream response headers relayed to the client as-is
+PASSTHROUGH_RESPONSE_HEADERS = (
+    "Content-Encoding",
+    "Content-Length",
+    "ETag",
+    "Cache-Control",
+)
+
+
+async def _relay(resp: httpx.Response):
+    try:
+        async for chunk in resp.aiter_raw():
+            yield chunk
+    finally:
+        await resp.aclose()
+
+
+async def _buffered_get(
+    base_url: str, path: str, headers: dict, params
+) -> HttpResponse:
+    try:
+        resp = await upstream.arequest(
+            "GET", base_url, path, headers=headers, params=params
+        )
+    except httpx.RequestError as e:
+        return _bad_gateway(e)
+    response = HttpResponse(
+        content=resp.content,
+        status=resp.status_code,
+        content_type=resp.headers.get("Content-Type", "application/json"),
+    )
+    # httpx has already decoded the body, so only cache headers carry over
+    for name in ("ETag", "Cache-Control"):
+        if name in resp.headers:
+            response[name] = resp.headers[name]
+    return response
+
+
+def _bad_gateway(e: Exception) -> HttpResponse:
+    return HttpResponse(
+        json.dumps({"detail": str(e)}),
+        status=502,
+        content_type="application/json",
+    )
+
+
+async def proxy_request(
     method: str,
     base_url: str,
     path: str,
     request,
     pass_headers: bool = True,
     json_body: bool = True,
-) -> HttpResponse:
-    url = f"{base_url.rstrip('/')}/api{path}"
+    *,
+    params=None,
+    body: bytes = None,
+    coalesce: bool = False,
+) -> StreamingHttpResponse:
+    """Forward the request bytes upstream and stream the response back without
+    parsing it. `params` and `body` replace the client's query string and body
+    when the gateway needs to rewrite them. With `coalesce`, a GET is buffered
+    instead so identical concurrent GETs can share one upstream call."""
+    if method not in ("GET", "POST", "PATCH"):
+        return HttpResponse(status=405)
     headers = {}
     if pass_headers:
-        auth = request.headers.get("Authorization")
-        if auth:
-            headers["Authorization"] = auth
-        content_type = request.headers.get("Content-Type")
-        if content_type:
-            headers["Content-Type"] = content_type
+        for name in PASSTHROUGH_REQUEST_HEADERS:
+            value = request.headers.get(name)
+            if value:
+                headers[name] = value
+    if params is None:
+        params = upstream.query_params(request.GET)
+    if method == "GET":
+        body = None
+    elif body is None:
+        body = request.body or None
+    if json_body and body:
+        headers.setdefault("Content-Type", "application/json")
+    if coalesce and method == "GET":
+        return await _buffered_get(base_url, path, headers, params)
+    client = upstream.get_async_client(base_url)
+    upstream_request = client.build_request(
+        method, path, headers=headers, params=params, content=body
+    )
     try:
-        if method == "GET":
-            resp = requests.get(url, headers=headers, params=request.GET, timeout=30)
-        elif method == "POST":
-            body = request.body if request.body else None
-            if json_body and body:
-                headers.setdefault("Content-Type", "application/json")
-            resp = requests.post(
-                url, headers=headers, data=body, params=request.GET, timeout=30
-            )
-        elif method == "PATCH":
-            body = request.body if request.body else None
-            if json_body and body:
-                headers.setdefault("Content-Type", "application/json")
-            resp = requests.patch(url, headers=headers, data=body, timeout=30)
-        else:
-            return HttpResponse(status=405)
-    except requests.RequestException as e:
-        return HttpResponse(
-            json.dumps({"detail": str(e)}),
-            status=502,
-            content_type="application/json",
-        )
-    return HttpResponse(
-        content=resp.content,
+        resp = await upstream.asend(base_url, upstream_request)
+    except httpx.RequestError as e:
+        return _bad_gateway(e)
+    response = StreamingHttpResponse(
+        _relay(resp),
         status=resp.status_code,
         content_type=resp.headers.get("Content-Type", "application/json"),
     )
+    for name in PASSTHROUGH_RESPONSE_HEADERS:
+        if name in resp.headers:
+            response[name] = resp.headers[name]
+    return response
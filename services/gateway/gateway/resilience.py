@@ -0,0 +1,218 @@
+import threading
+import time
+from typing import Optional, Tuple
+
+from django.conf import settings
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+KNOWN_UPSTREAMS = ("auth", "orders", "inventory", "lambda")
+
+
+class UpstreamUnavailable(Exception):
+    """Raised instead of calling an upstream whose circuit is open or whose
+    bulkhead is full. Rendered as 503 with Retry-After."""
+
+    def __init__(self, upstream: str, reason: str, retry_after: float):
+        super().__init__(f"{upstream} unavailable: {reason}")
+        self.upstream = upstream
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures, rejects calls for
+    `reset_timeout` seconds, then lets a single probe through (half-open):
+    its outcome closes the circuit or opens it again."""
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> Tuple[Optional[float], bool]:
+        """(retry_after, probe): retry_after is None if the call may proceed,
+        otherwise seconds until it is worth retrying."""
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self.opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    return remaining, False
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    return 1.0, False
+                self._probing = True
+                return None, True
+            return None, False
+
+    def record(self, ok: Optional[bool], probe: bool = False) -> None:
+        """`ok=None` means the call was abandoned and says nothing about health."""
+        with self._lock:
+            if probe:
+                self._probing = False
+            if ok is None:
+                return
+            if ok:
+                self.failures = 0
+                self.state = CLOSED
+                return
+            self.failures += 1
+            if probe or self.failures >= self.threshold:
+                if self.state != OPEN:
+                    self.times_opened += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Smoothed latency and deviation, the way TCP estimates its RTO. The
+    timeout is latency + 4 deviations, clamped to [floor, ceiling]; with no
+    samples yet it is the ceiling."""
+
+    ALPHA = 0.125
+    BETA = 0.25
+
+    def __init__(self, floor: float, ceiling: float):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.latency: Optional[float] = None
+        self.deviation = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            if self.latency is None:
+                self.latency = seconds
+                self.deviation = seconds / 2
+                return
+            self.deviation += self.BETA * (abs(seconds - self.latency) - self.deviation)
+            self.latency += self.ALPHA * (seconds - self.latency)
+
+    def timeout(self) -> float:
+        if self.latency is None:
+            return self.ceiling
+        estimate = self.latency + 4 * self.deviation
+        return max(self.floor, min(self.ceiling, estimate))
+
+
+class UpstreamGuard:
+    """Circuit breaker, bulkhead and adaptive timeout for one upstream."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.breaker = CircuitBreaker(
+            settings.UPSTREAM_BREAKER_THRESHOLD, settings.UPSTREAM_BREAKER_RESET
+        )
+        self.latency = LatencyTracker(
+            settings.UPSTREAM_TIMEOUT_MIN, settings.UPSTREAM_READ_TIMEOUT
+        )
+        self.max_concurrency = settings.UPSTREAM_MAX_CONCURRENCY
+        self.in_flight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def call(self, ceiling: Optional[float] = None) -> "_Call":
+        """Context manager around one upstream call. Raises UpstreamUnavailable
+        on entry; an exception inside the block counts as a failure, and so
+        does a 5xx passed to status()."""
+        return _Call(self, ceiling)
+
+    def _admit(self) -> bool:
+        with self._lock:
+            if self.in_flight >= self.max_concurrency:
+                self.rejected += 1
+                raise UpstreamUnavailable(self.name, "too many concurrent calls", 1)
+            self.in_flight += 1
+        # Bulkhead first: a probe admitted by the breaker must always run
+        retry_after, probe = self.breaker.before_call()
+        if retry_after is not None:
+            with self._lock:
+                self.in_flight -= 1
+                self.rejected += 1
+            raise UpstreamUnavailable(self.name, "circuit open", retry_after)
+        return probe
+
+    def _finish(self, ok: Optional[bool], probe: bool, elapsed: float) -> None:
+        with self._lock:
+            self.in_flight -= 1
+        if ok:
+            self.latency.observe(elapsed)
+        self.breaker.record(ok, probe)
+
+    def stats(self) -> dict:
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "times_opened": self.breaker.times_opened,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "rejected": self.rejected,
+            "latency": self.latency.latency,
+            "timeout": self.latency.timeout(),
+        }
+
+
+class _Call:
+    def __init__(self, guard: UpstreamGuard, ceiling: Optional[float]):
+        self.guard = guard
+        self.timeout = guard.latency.timeout()
+        if ceiling is not None:
+            self.timeout = min(self.timeout, ceiling)
+        self.failed = False
+
+    def status(self, status_code: int) -> None:
+        if status_code >= 500:
+            self.failed = True
+
+    def __enter__(self) -> "_Call":
+        self.probe = self.guard._admit()
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None and not issubclass(exc_type, Exception):
+            ok = None  # cancelled, e.g. the client went away
+        else:
+            ok = exc_type is None and not self.failed
+        self.guard._finish(ok, self.probe, time.monotonic() - self.started)
+
+
+_guards: dict = {}
+_guards_lock = threading.Lock()
+
+
+def guard(name: str) -> UpstreamGuard:
+    g = _guards.get(name)
+    if g is None:
+        with _guards_lock:
+            g = _guards.get(name)
+            if g is None:
+                g = _guards[name] = UpstreamGuard(name)
+    return g
+
+
+def _upstream_names() -> dict:
+    return {
+        settings.AUTH_SERVICE_URL.rstrip("/"): "auth",
+        settings.ORDERS_SERVICE_URL.rstrip("/"): "orders",
+        settings.INVENTORY_SERVICE_URL.rstrip("/"): "inventory",
+    }
+
+
+def guard_for_url(base_url: str) -> UpstreamGuard:
+    key = base_url.rstrip("/")
+    return guard(_upstream_names().get(key, key))
+
+
+def stats() -> dict:
+    for name in KNOWN_UPSTREAMS:
+        guard(name)
+    return {name: g.stats() for name, g in sorted(_guards.items())}
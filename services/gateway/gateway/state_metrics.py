@@ -0,0 +1,87 @@
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from . import resilience
+from .auth import token_cache
+from .singleflight import upstream_gets
+
+
+class GatewayStateCollector:
+    """Circuit breaker, bulkhead, request coalescing and token cache state,
+    read at scrape time and served on /metrics, which nginx does not route."""
+
+    def collect(self):
+        state = GaugeMetricFamily(
+            "gateway_upstream_circuit_state",
+            "1 for the circuit breaker's current state",
+            labels=["upstream", "state"],
+        )
+        failures = GaugeMetricFamily(
+            "gateway_upstream_consecutive_failures",
+            "Failures since the last success",
+            labels=["upstream"],
+        )
+        opened = CounterMetricFamily(
+            "gateway_upstream_circuit_opened",
+            "Times the circuit has opened",
+            labels=["upstream"],
+        )
+        in_flight = GaugeMetricFamily(
+            "gateway_upstream_in_flight",
+            "Calls in progress",
+            labels=["upstream"],
+        )
+        limit = GaugeMetricFamily(
+            "gateway_upstream_max_concurrency",
+            "Bulkhead size",
+            labels=["upstream"],
+        )
+        rejected = CounterMetricFamily(
+            "gateway_upstream_rejected",
+            "Calls refused by the open circuit or full bulkhead",
+            labels=["upstream"],
+        )
+        latency = GaugeMetricFamily(
+            "gateway_upstream_smoothed_latency_seconds",
+            "Smoothed response time the adaptive timeout is based on",
+            labels=["upstream"],
+        )
+        timeout = GaugeMetricFamily(
+            "gateway_upstream_timeout_seconds",
+            "Current adaptive read timeout",
+            labels=["upstream"],
+        )
+        for name, s in resilience.stats().items():
+            for value in (resilience.CLOSED, resilience.OPEN, resilience.HALF_OPEN):
+                state.add_metric([name, value], 1 if s["state"] == value else 0)
+            failures.add_metric([name], s["consecutive_failures"])
+            opened.add_metric([name], s["times_opened"])
+            in_flight.add_metric([name], s["in_flight"])
+            limit.add_metric([name], s["max_concurrency"])
+            rejected.add_metric([name], s["rejected"])
+            if s["latency"] is not None:
+                latency.add_metric([name], s["latency"])
+            timeout.add_metric([name], s["timeout"])
+        yield from (state, failures, opened, in_flight, limit, rejected)
+        yield from (latency, timeout)
+
+        coalescing = upstream_gets.stats()
+        yield CounterMetricFamily(
+            "gateway_coalesced_calls",
+            "Upstream GETs started",
+            value=coalescing["calls"],
+        )
+        yield CounterMetricFamily(
+            "gateway_coalesced_waiters",
+            "GETs that shared a call already in flight",
+            value=coalescing["coalesced"],
+        )
+        cache = token_cache.stats()
+        yield CounterMetricFamily(
+            "gateway_token_cache_hits", "Token cache hits", value=cache["hits"]
+        )
+        yield CounterMetricFamily(
+            "gateway_token_cache_misses", "Token cache misses", value=cache["misses"]
+        )
+        yield GaugeMetricFamily(
+            "gateway_token_cache_size", "Cached verifications", value=cache["size"]
+        )
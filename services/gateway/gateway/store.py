@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import time
+import weakref
+from collections import OrderedDict
+from typing import Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "gateway:"
+
+
+class MemoryStore:
+    """In-process stand-in for Redis (REDIS_URL=""), for tests and local
+    runs. Nothing is shared between processes or survives a restart; past
+    `max_keys` the least recently written keys are evicted."""
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def _live(self, key: str) -> Optional[tuple]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] is not None and entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        return entry
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._live(key)
+        return None if entry is None else entry[1]
+
+    async def set(self, key: str, value: str, ttl: float = None, nx=False) -> bool:
+        if nx and self._live(key) is not None:
+            return False
+        expires = time.monotonic() + ttl if ttl else None
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+        return True
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._entries.pop(key, None)
+
+    async def keys(self, prefix: str) -> list:
+        return [
+            k for k in list(self._entries) if k.startswith(prefix) and self._live(k)
+        ]
+
+
+class RedisStore:
+    """String keys with optional expiry in Redis, shared by every gateway
+    process. Clients are bound to the event loop that created them."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self._clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+    def _client(self):
+        import redis.asyncio as redis
+
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = redis.from_url(
+                self.url, decode_responses=True
+            )
+        return client
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._client().get(key)
+
+    async def set(self, key: str, value: str, ttl: float = None, nx=False) -> bool:
+        px = max(1, int(ttl * 1000)) if ttl else None
+        return bool(await self._client().set(key, value, px=px, nx=nx))
+
+    async def delete(self, *keys: str) -> None:
+        if keys:
+            await self._client().delete(*keys)
+
+    async def keys(self, prefix: str) -> list:
+        return [k async for k in self._client().scan_iter(match=f"{prefix}*")]
+
+
+_stores: dict = {}
+
+
+def get_store(name: str = "default"):
+    """ "default" (REDIS_URL) holds checkout progress and must never be
+    evicted; "idempotency" (IDEMPOTENCY_REDIS_URL) holds replayable results
+    and may be, so it lives in its own memory-bounded instance. Neither
+    falls back to the other's Redis."""
+    store = _stores.get(name)
+    if store is None:
+        url = (
+            settings.IDEMPOTENCY_REDIS_URL
+            if name == "idempotency"
+            else settings.REDIS_URL
+        )
+        if url:
+            store = RedisStore(url)
+        else:
+            if name == "idempotency" and settings.REDIS_URL:
+                logger.warning(
+                    "IDEMPOTENCY_REDIS_URL is not set: idempotency keys are "
+                    "kept per process and not shared between gateways"
+                )
+            store = MemoryStore(settings.LOCAL_STORE_MAX_KEYS)
+        _stores[name] = store
+    return store
@@ -0,0 +1,461 @@
+import asyncio
+import json
+import time
+from unittest import mock
+
+import httpx
+import jwt
+import requests
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from ninja.errors import HttpError
+
+from .asgi import application
+from .cache import MISSING, TTLCache
+from . import auth, store, upstream
+from .events import EventRelay, connect
+from .idempotency import idempotent
+from .notifications import relay
+from .singleflight import SingleFlight
+from .resilience import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    LatencyTracker,
+    UpstreamGuard,
+    UpstreamUnavailable,
+)
+
+IN_MEMORY_LAYER = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+def access_token(user_id, expires_in=600, secret=None, **claims) -> str:
+    payload = {"sub": str(user_id), "type": "access", "exp": time.time() + expires_in}
+    return jwt.encode(
+        {**payload, **claims},
+        secret or settings.JWT_SECRET_KEY,
+        algorithm=settings.JWT_ALGORITHM,
+    )
+
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_LAYER, JWT_VERIFY_MODE="local", JWT_USER_CHECK_TTL=0
+)
+class NotificationBatchTests(SimpleTestCase):
+    @override_settings(WS_BATCH_WINDOW=0.3)
+    def test_replaced_snapshot_stays_after_earlier_deltas(self):
+        async def scenario():
+            socket = WebsocketCommunicator(
+                application, f"/ws/notifications/?token={access_token(7)}"
+            )
+            connected, _ = await socket.connect()
+            self.assertTrue(connected)
+            await socket.send_json_to({"action": "subscribe", "products": ["p1"]})
+            await socket.receive_nothing(0.05)
+            await relay(
+                [
+                    {"type": "stock.updated", "product_id": "p1", "quantity": 5},
+                    {"type": "stock.reserved", "product_id": "p1", "quantity": 2},
+                    {"type": "stock.updated", "product_id": "p1", "quantity": 9},
+                ]
+            )
+            frame = await socket.receive_json_from(timeout=2)
+            await socket.disconnect()
+            return frame
+
+        events = async_to_sync(scenario)()["events"]
+        self.assertEqual(
+            [(e["type"], e["quantity"]) for e in events],
+            [("stock.reserved", 2), ("stock.updated", 9)],
+        )
+
+    @override_settings(WS_MAX_SUBSCRIPTIONS=2)
+    def test_subscriptions_stop_at_the_cap(self):
+        async def scenario():
+            socket = WebsocketCommunicator(
+                application, f"/ws/notifications/?token={access_token(7)}"
+            )
+            await socket.connect()
+            for products in (["p1", "p2", "p3"], ["p1", "p4"]):
+                await socket.send_json_to({"action": "subscribe", "products": products})
+            await socket.receive_nothing(0.05)
+            await relay(
+                [
+                    {"type": "stock.updated", "product_id": p, "quantity": 1}
+                    for p in ("p1", "p2", "p3", "p4")
+                ]
+            )
+            frame = await socket.receive_json_from(timeout=2)
+            await socket.disconnect()
+            return frame
+
+        events = async_to_sync(scenario)()["events"]
+        self.assertEqual(sorted(e["product_id"] for e in events), ["p1", "p2"])
+
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_LAYER, JWT_VERIFY_MODE="local", JWT_USER_CHECK_TTL=0
+)
+class EventRelayTests(SimpleTestCase):
+    def test_published_events_reach_the_socket_once(self):
+        # Shaped like the orders outbox relay's message
+        body = json.dumps(
+            {
+                "events": [
+                    {
+                        "event_id": "orders:1",
+                        "type": "order.created",
+                        "source": "orders",
+                        "order_id": 1,
+                        "user_id": 7,
+                        "status": "pending",
+                    }
+                ]
+            }
+        ).encode()
+
+        async def scenario():
+            socket = WebsocketCommunicator(
+                application, f"/ws/notifications/?token={access_token(7)}"
+            )
+            await socket.connect()
+            source = connect("memory://", "test", 1)
+            # At-least-once delivery: the same message may arrive twice
+            source.send("orders.events", body, "orders:1-1")
+            source.send("orders.events", body, "orders:1-1")
+            event_relay = EventRelay()
+            sent = 0
+            for message, ack in source.messages():
+                sent += await event_relay.handle(message)
+                ack()
+            frame = await socket.receive_json_from(timeout=2)
+            self.assertTrue(await socket.receive_nothing(0.2))
+            await socket.disconnect()
+            return sent, frame
+
+        sent, frame = async_to_sync(scenario)()
+        self.assertEqual(sent, 1)
+        self.assertEqual([e["event_id"] for e in frame["events"]], ["orders:1"])
+
+
+class IdempotencyTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(store._stores, {"idempotency": store.MemoryStore()})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.calls = 0
+
+    def post(self, view, body=b"{}", key="k1"):
+        request = RequestFactory().post(
+            "/api/orders/bulk",
+            body,
+            content_type="application/json",
+            HTTP_IDEMPOTENCY_KEY=key,
+        )
+        request.auth = 7
+        return async_to_sync(view)(request)
+
+    def counting_view(self, size: int):
+        @idempotent
+        async def view(request):
+            self.calls += 1
+            return HttpResponse(b"x" * size, content_type="application/json")
+
+        return view
+
+    def test_duplicate_replays_the_stored_response(self):
+        view = self.counting_view(10)
+        first, second = self.post(view), self.post(view)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+
+    def test_key_reused_for_another_body_is_rejected(self):
+        view = self.counting_view(10)
+        self.post(view)
+        with self.assertRaises(HttpError) as raised:
+            self.post(view, body=b'{"other": 1}')
+        self.assertEqual(raised.exception.status_code, 422)
+        self.assertEqual(self.calls, 1)
+
+    @override_settings(IDEMPOTENCY_MAX_BODY=100)
+    def test_oversized_response_is_never_run_twice(self):
+        view = self.counting_view(1000)
+        first = self.post(view)
+        second = self.post(view)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(len(first.content), 1000)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(second.status_code, 409)
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(json.loads(second.content)["status"], 200)
+
+
+@override_settings(JWT_VERIFY_MODE="remote", AUTH_SERVICE_URL="http://auth:8000")
+class RemoteVerifyTests(SimpleTestCase):
+    def setUp(self):
+        auth.token_cache.clear()
+
+    def verify(self, outcome):
+        with mock.patch.object(auth.upstream, "request", side_effect=[outcome]):
+            return auth.verify_token("some-token")
+
+    def test_unreachable_auth_service_is_503_and_not_cached(self):
+        for outcome in (requests.ConnectTimeout(), mock.Mock(status_code=502)):
+            with self.assertRaises(UpstreamUnavailable):
+                self.verify(outcome)
+        self.assertEqual(auth.token_cache.stats()["size"], 0)
+        ok = mock.Mock(status_code=200, json=lambda: {"user_id": 7})
+        self.assertEqual(self.verify(ok), 7)
+
+    def test_rejected_token_is_cached(self):
+        self.assertIsNone(self.verify(mock.Mock(status_code=401, text="")))
+        self.assertEqual(auth.token_cache.stats()["size"], 1)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch("gateway.resilience.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(threshold=3, reset_timeout=10)
+
+    def trip(self):
+        for _ in range(3):
+            self.breaker.record(False)
+
+    def test_trips_after_consecutive_failures(self):
+        self.breaker.record(False)
+        self.breaker.record(False)
+        self.breaker.record(True)
+        self.breaker.record(False)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.trip()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker.before_call(), (10, False))
+
+    def test_cool_down_lets_one_probe_through(self):
+        self.trip()
+        self.now += 4
+        self.assertEqual(self.breaker.before_call(), (6, False))
+        self.now += 6
+        self.assertEqual(self.breaker.before_call(), (None, True))
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertEqual(self.breaker.before_call(), (1.0, False))
+
+    def test_probe_success_closes(self):
+        self.trip()
+        self.now += 10
+        self.breaker.before_call()
+        self.breaker.record(True, probe=True)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertEqual(self.breaker.before_call(), (None, False))
+
+    def test_probe_failure_reopens_for_another_cool_down(self):
+        self.trip()
+        self.now += 10
+        self.breaker.before_call()
+        self.breaker.record(False, probe=True)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker.before_call(), (10, False))
+        self.assertEqual(self.breaker.times_opened, 2)
+
+    def test_abandoned_probe_frees_the_slot(self):
+        self.trip()
+        self.now += 10
+        self.breaker.before_call()
+        self.breaker.record(None, probe=True)
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertEqual(self.breaker.before_call(), (None, True))
+
+
+@override_settings(
+    UPSTREAM_MAX_CONCURRENCY=2,
+    UPSTREAM_BREAKER_THRESHOLD=1,
+    UPSTREAM_BREAKER_RESET=10,
+    UPSTREAM_TIMEOUT_MIN=1,
+    UPSTREAM_READ_TIMEOUT=30,
+)
+class UpstreamGuardTests(SimpleTestCase):
+    def test_bulkhead_rejects_past_max_concurrency(self):
+        guard = UpstreamGuard("orders")
+        with guard.call(), guard.call():
+            with self.assertRaises(UpstreamUnavailable) as raised:
+                with guard.call():
+                    pass
+            self.assertEqual(raised.exception.reason, "too many concurrent calls")
+        self.assertEqual((guard.in_flight, guard.rejected), (0, 1))
+        with guard.call():
+            pass
+
+    def test_5xx_opens_the_circuit(self):
+        guard = UpstreamGuard("orders")
+        with guard.call() as call:
+            call.status(503)
+        with self.assertRaises(UpstreamUnavailable) as raised:
+            with guard.call():
+                pass
+        self.assertEqual(raised.exception.reason, "circuit open")
+        self.assertEqual(guard.in_flight, 0)
+
+    def test_timeout_follows_latency_within_bounds(self):
+        tracker = LatencyTracker(floor=1, ceiling=30)
+        self.assertEqual(tracker.timeout(), 30)
+        for _ in range(50):
+            tracker.observe(0.01)
+        self.assertEqual(tracker.timeout(), 1)
+        for _ in range(50):
+            tracker.observe(100)
+        self.assertEqual(tracker.timeout(), 30)
+        self.assertEqual(UpstreamGuard("orders").call(ceiling=2).timeout, 2)
+
+
+@override_settings(UPSTREAM_COALESCE_GETS=True)
+class CoalescedGetTests(SimpleTestCase):
+    BASE = "http://coalesce-test"
+
+    def run_with_upstream(self, handler, scenario):
+        """Run `scenario(release)` against an upstream answered by `handler`;
+        requests are held until the scenario sets `release`."""
+
+        async def run():
+            release = asyncio.Event()
+            calls = []
+
+            async def handle(request):
+                calls.append(request.url.path)
+                await release.wait()
+                return handler(request)
+
+            client = httpx.AsyncClient(
+                base_url=f"{self.BASE}/api", transport=httpx.MockTransport(handle)
+            )
+            with mock.patch.object(
+                upstream, "get_async_client", return_value=client
+            ), mock.patch.object(upstream, "upstream_gets", SingleFlight()):
+                try:
+                    return await scenario(release), calls
+                finally:
+                    await client.aclose()
+
+        return async_to_sync(run)()
+
+    def get(self):
+        return upstream.arequest("GET", self.BASE, "/stock", params={"ids": "p1"})
+
+    def test_concurrent_identical_gets_share_one_call(self):
+        async def scenario(release):
+            waiters = [asyncio.ensure_future(self.get()) for _ in range(5)]
+            await asyncio.sleep(0.01)
+            release.set()
+            return [r.json() for r in await asyncio.gather(*waiters)]
+
+        results, calls = self.run_with_upstream(
+            lambda request: httpx.Response(200, json={"p1": 3}), scenario
+        )
+        self.assertEqual(results, [{"p1": 3}] * 5)
+        self.assertEqual(calls, ["/api/stock"])
+
+    def test_leader_failure_reaches_every_waiter(self):
+        def fail(request):
+            raise httpx.ConnectError("refused", request=request)
+
+        async def scenario(release):
+            waiters = [asyncio.ensure_future(self.get()) for _ in range(3)]
+            await asyncio.sleep(0.01)
+            release.set()
+            return await asyncio.gather(*waiters, return_exceptions=True)
+
+        results, calls = self.run_with_upstream(fail, scenario)
+        self.assertEqual([type(r) for r in results], [httpx.ConnectError] * 3)
+        self.assertEqual(len(calls), 1)
+
+    def test_cancelled_waiter_does_not_cancel_the_shared_call(self):
+        async def scenario(release):
+            first = asyncio.ensure_future(self.get())
+            second = asyncio.ensure_future(self.get())
+            await asyncio.sleep(0.01)
+            first.cancel()
+            await asyncio.sleep(0.01)
+            release.set()
+            return first.cancelled(), (await second).json()
+
+        (cancelled, result), calls = self.run_with_upstream(
+            lambda request: httpx.Response(200, json={"p1": 3}), scenario
+        )
+        self.assertTrue(cancelled)
+        self.assertEqual(result, {"p1": 3})
+        self.assertEqual(len(calls), 1)
+
+
+@override_settings(
+    JWT_VERIFY_MODE="local",
+    JWT_USER_CHECK_TTL=0,
+    JWT_CACHE_TTL=300,
+    JWT_NEGATIVE_CACHE_TTL=5,
+)
+class LocalVerifyTests(SimpleTestCase):
+    def setUp(self):
+        auth.token_cache.clear()
+
+    def test_claims_are_checked(self):
+        self.assertEqual(auth.verify_token(access_token(7)), 7)
+        rejected = [
+            access_token(7, secret="another-secret"),
+            access_token(7, type="refresh"),
+            access_token("someone"),
+            access_token(7, exp="tomorrow"),
+        ]
+        for token in rejected:
+            self.assertIsNone(auth.verify_token(token))
+
+    def test_expiry_allows_the_leeway_and_no_more(self):
+        leeway = auth.JWT_LEEWAY_SECONDS
+        self.assertEqual(auth.verify_token(access_token(7, -(leeway - 5))), 7)
+        self.assertIsNone(auth.verify_token(access_token(7, -(leeway + 5))))
+
+    def test_positive_entries_expire_with_the_token(self):
+        self.assertAlmostEqual(auth._cache_ttl(access_token(7, 60), 7), 60, delta=1)
+        self.assertEqual(auth._cache_ttl(access_token(7, 3600), 7), 300)
+        self.assertEqual(auth._cache_ttl(access_token(7), None), 5)
+
+    def test_results_are_cached_per_token(self):
+        token = access_token(7)
+        auth.verify_token(token)
+        with mock.patch.object(auth, "_decode_access_token") as decode:
+            self.assertEqual(auth.verify_token(token), 7)
+        decode.assert_not_called()
+        self.assertEqual(auth.token_cache.stats()["hits"], 1)
+
+
+class TTLCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch("gateway.cache.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(2)
+        cache.set("a", 1, 60)
+        cache.set("b", 2, 60)
+        cache.get("a")
+        cache.set("c", 3, 60)
+        self.assertIs(cache.get("b"), MISSING)
+        self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+
+    def test_entries_expire_individually(self):
+        cache = TTLCache(10)
+        cache.set("short", 1, 5)
+        cache.set("long", 2, 50)
+        cache.set("never", 3, 0)
+        self.now += 10
+        self.assertIs(cache.get("short"), MISSING)
+        self.assertEqual(cache.get("long"), 2)
+        self.assertIs(cache.get("never"), MISSING)
+        self.assertEqual(cache.stats()["size"], 1)
@@ -0,0 +1,163 @@
+import asyncio
+import threading
+import weakref
+from contextlib import contextmanager
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from . import resilience, tracing
+from .metrics import timed
+from .singleflight import upstream_gets
+
+_sessions: dict = {}
+_lock = threading.Lock()
+# Async clients are bound to the event loop that created them
+_async_clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+# Forwarded request headers that upstreams do not vary their response on, so
+# they are left out of the single-flight key
+_COALESCE_IGNORED_HEADERS = {"authorization"}
+
+
+def _new_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=settings.UPSTREAM_POOL_SIZE,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(base_url: str) -> requests.Session:
+    """Shared keep-alive session for one upstream service."""
+    key = base_url.rstrip("/")
+    session = _sessions.get(key)
+    if session is None:
+        with _lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _sessions[key] = _new_session()
+    return session
+
+
+def default_timeout() -> tuple:
+    return (settings.UPSTREAM_CONNECT_TIMEOUT, settings.UPSTREAM_READ_TIMEOUT)
+
+
+@contextmanager
+def _hop(base_url: str, method: str, path: str, ceiling: float = None):
+    """Circuit breaker, latency metric and a trace span around one call."""
+    guard = resilience.guard_for_url(base_url)
+    name = f"upstream.{guard.name}"
+    with guard.call(ceiling) as call, timed(name), tracing.span(
+        name, method=method, path=path
+    ) as span:
+        yield call, span
+
+
+def _record(call, span, resp) -> None:
+    call.status(resp.status_code)
+    span.attributes["status"] = resp.status_code
+
+
+def request(method: str, base_url: str, path: str, **kwargs) -> requests.Response:
+    """Send `method` to `<base_url>/api<path>` over the upstream's pool,
+    through its circuit breaker. An explicit (connect, read) `timeout` caps
+    the adaptive read timeout."""
+    url = f"{base_url.rstrip('/')}/api{path}"
+    connect, ceiling = kwargs.pop("timeout", default_timeout())
+    with _hop(base_url, method, path, ceiling) as (call, span):
+        kwargs["headers"] = tracing.inject(kwargs.get("headers"))
+        resp = get_session(base_url).request(
+            method, url, timeout=(connect, call.timeout), **kwargs
+        )
+        _record(call, span, resp)
+    return resp
+
+
+def _new_async_client(base_url: str) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=f"{base_url}/api",
+        limits=httpx.Limits(
+            max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.UPSTREAM_POOL_SIZE,
+        ),
+        timeout=httpx.Timeout(
+            settings.UPSTREAM_READ_TIMEOUT,
+            connect=settings.UPSTREAM_CONNECT_TIMEOUT,
+        ),
+    )
+
+
+def get_async_client(base_url: str) -> httpx.AsyncClient:
+    """Shared keep-alive async client for one upstream service."""
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.setdefault(loop, {})
+    key = base_url.rstrip("/")
+    client = clients.get(key)
+    if client is None:
+        client = clients[key] = _new_async_client(key)
+    return client
+
+
+def _flight_key(base_url: str, path: str, params, headers) -> tuple:
+    return (
+        base_url.rstrip("/"),
+        path,
+        tuple(sorted(httpx.QueryParams(params).multi_items())) if params else (),
+        tuple(
+            sorted(
+                (k.lower(), v)
+                for k, v in (headers or {}).items()
+                if k.lower() not in _COALESCE_IGNORED_HEADERS
+            )
+        ),
+    )
+
+
+def _timeout(call) -> httpx.Timeout:
+    return httpx.Timeout(call.timeout, connect=settings.UPSTREAM_CONNECT_TIMEOUT)
+
+
+async def _guarded_request(base_url: str, method: str, path: str, **kwargs):
+    client = get_async_client(base_url)
+    with _hop(base_url, method, path) as (call, span):
+        kwargs["headers"] = tracing.inject(kwargs.get("headers"))
+        resp = await client.request(method, path, timeout=_timeout(call), **kwargs)
+        _record(call, span, resp)
+    return resp
+
+
+async def asend(base_url: str, upstream_request: httpx.Request) -> httpx.Response:
+    """Send a prebuilt request with a streamed response through the
+    upstream's circuit breaker; only the wait for headers is timed."""
+    client = get_async_client(base_url)
+    method, path = upstream_request.method, upstream_request.url.path
+    with _hop(base_url, method, path) as (call, span):
+        upstream_request.extensions["timeout"] = _timeout(call).as_dict()
+        upstream_request.headers["traceparent"] = span.traceparent
+        resp = await client.send(upstream_request, stream=True)
+        _record(call, span, resp)
+    return resp
+
+
+async def arequest(method: str, base_url: str, path: str, **kwargs) -> httpx.Response:
+    """Async counterpart of request(); raises httpx.RequestError on transport
+    failure and UpstreamUnavailable when the circuit is open or the bulkhead
+    full. Concurrent identical GETs share one upstream call, traced as part
+    of whichever request started it."""
+    if method != "GET" or not settings.UPSTREAM_COALESCE_GETS:
+        return await _guarded_request(base_url, method, path, **kwargs)
+    key = _flight_key(base_url, path, kwargs.get("params"), kwargs.get("headers"))
+    return await upstream_gets.do(
+        key, lambda: _guarded_request(base_url, method, path, **kwargs)
+    )
+
+
+def query_params(querydict) -> list:
+    """Flatten a Django QueryDict into (key, value) pairs for httpx."""
+    return [(k, v) for k, values in querydict.lists() for v in values]
@@ -1,7 +1,9 @@
 from django.urls import path
 from ninja import NinjaAPI
 from gateway.api import api
+from gateway.metrics import metrics_view
 
 urlpatterns = [
     path("api/", api.urls),
+    path("metrics", metrics_view),
 ]
@@ -1,31 +1,37 @@
+from collections import defaultdict
+from typing import List, Optional, Union
+
+from django.db import transaction
+from django.db import models
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
 from ninja import NinjaAPI
 from ninja.errors import HttpError
 
+from .cache import STOCK_LIST_KEY, cached_json_response, invalidate_stock, stock_key
+from .events import emit, emit_many
+from .metrics import TimedJSONRenderer
 from .models import Stock, Reservation
-from .schemas import StockOut, ReserveIn, ReserveOut, StockIn
-
-api = NinjaAPI(title="Inventory API", version="1.0")
+from .schemas import (
+    BatchReserveIn,
+    BatchReserveOut,
+    ReserveIn,
+    ReserveItemOut,
+    ReserveOut,
+    StockIn,
+    StockLookupIn,
+    StockLookupOut,
+    StockOut,
+    StockSummaryOut,
+)
 
+api = NinjaAPI(title="Inventory API", version="1.0", renderer=TimedJSONRenderer())
 
-@api.get("/stock", response=list[StockOut])
-def list_stock(request):
-    return [
-        StockOut(
-            product_id=s.product_id,
-            quantity=s.quantity,
-            reserved=s.reserved,
-            available=s.quantity - s.reserved,
-        )
-        for s in Stock.objects.all()
-    ]
+MAX_LOOKUP_IDS = 200
 
 
-@api.get("/stock/{product_id}", response=StockOut)
-def get_stock(request, product_id: str):
-    try:
-        s = Stock.objects.get(product_id=product_id)
-    except Stock.DoesNotExist:
-        raise HttpError(404, "Product not found")
+def _stock_out(s: Stock) -> StockOut:
     return StockOut(
         product_id=s.product_id,
         quantity=s.quantity,
@@ -34,48 +40,242 @@ def get_stock(request, product_id: str):
     )
 
 
-@api.post("/stock", response=StockOut)
-def create_or_update_stock(request, payload: StockIn):
-    stock, _ = Stock.objects.update_or_create(
-        product_id=payload.product_id,
-        defaults={"quantity": payload.quantity},
+def _lookup_stock(ids: list) -> StockLookupOut:
+    ids = list(dict.fromkeys(i for i in ids if i))
+    if len(ids) > MAX_LOOKUP_IDS:
+        raise HttpError(400, f"At most {MAX_LOOKUP_IDS} ids per lookup")
+    stocks = {s.product_id: s for s in Stock.objects.filter(product_id__in=ids)}
+    return StockLookupOut(
+        found=[_stock_out(stocks[i]) for i in ids if i in stocks],
+        missing=[i for i in ids if i not in stocks],
     )
-    return StockOut(
-        product_id=stock.product_id,
-        quantity=stock.quantity,
-        reserved=stock.reserved,
-        available=stock.quantity - stock.reserved,
+
+
+@api.get("/stock", response=Union[List[StockOut], StockLookupOut])
+def list_stock(request, ids: Optional[str] = None):
+    """Every stock row, or with ids=a,b,c only those products in one query,
+    split into found and missing."""
+    if ids is not None:
+        return _lookup_stock(ids.split(","))
+    return cached_json_response(
+        STOCK_LIST_KEY,
+        lambda: [_stock_out(s).model_dump() for s in Stock.objects.all()],
     )
 
 
+@api.post("/stock/lookup", response=StockLookupOut)
+def lookup_stock(request, payload: StockLookupIn):
+    return _lookup_stock(payload.ids)
+
+
+@api.get("/stock/summary", response=StockSummaryOut)
+def stock_summary(request, low_stock_threshold: int = 5):
+    totals = Stock.objects.aggregate(
+        total_products=Count("id"),
+        total_quantity=Sum("quantity"),
+        total_reserved=Sum("reserved"),
+        low_stock_count=Count(
+            "id", filter=Q(quantity__lte=F("reserved") + low_stock_threshold)
+        ),
+    )
+    quantity = totals["total_quantity"] or 0
+    reserved = totals["total_reserved"] or 0
+    return StockSummaryOut(
+        total_products=totals["total_products"],
+        total_quantity=quantity,
+        total_reserved=reserved,
+        total_available=quantity - reserved,
+        low_stock_threshold=low_stock_threshold,
+        low_stock_count=totals["low_stock_count"],
+    )
+
+
+@api.get("/stock/{product_id}", response=StockOut)
+def get_stock(request, product_id: str):
+    def build():
+        try:
+            s = Stock.objects.get(product_id=product_id)
+        except Stock.DoesNotExist:
+            raise HttpError(404, "Product not found")
+        return _stock_out(s).model_dump()
+
+    return cached_json_response(stock_key(product_id), build)
+
+
+@api.post("/stock", response=StockOut)
+def create_or_update_stock(request, payload: StockIn):
+    with transaction.atomic():
+        stock, _ = Stock.objects.update_or_create(
+            product_id=payload.product_id,
+            defaults={"quantity": payload.quantity},
+        )
+        invalidate_stock(stock.product_id)
+        emit(
+            "stock.updated",
+            product_id=stock.product_id,
+            quantity=stock.quantity,
+            reserved=stock.reserved,
+            available=stock.quantity - stock.reserved,
+        )
+    return _stock_out(stock)
+
+
 @api.post("/reserve", response=ReserveOut)
 def reserve(request, payload: ReserveIn):
-    try:
-        stock = Stock.objects.get(product_id=payload.product_id)
-    except Stock.DoesNotExist:
-        return ReserveOut(success=False, message="Product not found")
-    available = stock.quantity - stock.reserved
-    if payload.quantity > available:
-        return ReserveOut(success=False, message="Insufficient stock")
-    stock.reserved += payload.quantity
-    stock.save(update_fields=["reserved"])
-    Reservation.objects.create(
-        product_id=payload.product_id,
-        order_id=payload.order_id,
-        quantity=payload.quantity,
-    )
+    if payload.quantity <= 0:
+        return ReserveOut(success=False, message="Quantity must be positive")
+    with transaction.atomic():
+        # Check-and-increment in one UPDATE so concurrent workers cannot oversell
+        updated = Stock.objects.filter(
+            product_id=payload.product_id,
+            quantity__gte=F("reserved") + payload.quantity,
+        ).update(reserved=F("reserved") + payload.quantity, updated_at=timezone.now())
+        if not updated:
+            if not Stock.objects.filter(product_id=payload.product_id).exists():
+                return ReserveOut(success=False, message="Product not found")
+            return ReserveOut(success=False, message="Insufficient stock")
+        Reservation.objects.create(
+            product_id=payload.product_id,
+            order_id=payload.order_id,
+            quantity=payload.quantity,
+        )
+        invalidate_stock(payload.product_id)
+        emit(
+            "stock.reserved",
+            product_id=payload.product_id,
+            order_id=payload.order_id,
+            quantity=payload.quantity,
+        )
     return ReserveOut(success=True)
 
 
+class _BatchRejected(Exception):
+    """Rolls back a batch reservation as soon as one product cannot be reserved."""
+
+
+def _reserve_all(order_id: str, wanted: dict, failures: dict) -> None:
+    """Reserve every product in `wanted` or raise _BatchRejected, recording the
+    reason per product in `failures`. Rows are updated in product_id order so
+    concurrent batches lock them in the same order and cannot deadlock."""
+    product_ids = sorted(wanted)
+    with transaction.atomic():
+        now = timezone.now()
+        for product_id in product_ids:
+            quantity = wanted[product_id]
+            updated = Stock.objects.filter(
+                product_id=product_id,
+                quantity__gte=F("reserved") + quantity,
+            ).update(reserved=F("reserved") + quantity, updated_at=now)
+            if not updated:
+                failures[product_id] = "Insufficient stock"
+        if failures:
+            known = set(
+                Stock.objects.filter(product_id__in=failures).values_list(
+                    "product_id", flat=True
+                )
+            )
+            for product_id in failures:
+                if product_id not in known:
+                    failures[product_id] = "Product not found"
+            raise _BatchRejected
+        Reservation.objects.bulk_create(
+            Reservation(product_id=p, order_id=order_id, quantity=wanted[p])
+            for p in product_ids
+        )
+        invalidate_stock(*product_ids)
+        emit_many(
+            "stock.reserved",
+            [
+                {"product_id": p, "order_id": order_id, "quantity": wanted[p]}
+                for p in product_ids
+            ],
+        )
+
+
+@api.post("/reserve/batch", response=BatchReserveOut)
+def reserve_batch(request, payload: BatchReserveIn):
+    if not payload.items:
+        return BatchReserveOut(success=False, message="No items")
+    failures = {}
+    wanted = defaultdict(int)
+    for item in payload.items:
+        if item.quantity <= 0:
+            failures[item.product_id] = "Quantity must be positive"
+        wanted[item.product_id] += item.quantity
+    if not failures:
+        try:
+            _reserve_all(payload.order_id, wanted, failures)
+        except _BatchRejected:
+            pass
+    return BatchReserveOut(
+        success=not failures,
+        message="Some items could not be reserved" if failures else "",
+        items=[
+            ReserveItemOut(
+                product_id=item.product_id,
+                quantity=item.quantity,
+                success=not failures,
+                message=failures.get(item.product_id, ""),
+            )
+            for item in payload.items
+        ],
+    )
+
+
+class _ReleaseConflict(Exception):
+    """The order's reservations changed between aggregating and deleting them."""
+
+
+def _release_order(order_id: str) -> list:
+    """Give back everything reserved for `order_id` in one transaction: sum the
+    reservations per product, delete them, and decrement Stock.reserved with a
+    single UPDATE. Returns the affected product ids."""
+    with transaction.atomic():
+        reservations = Reservation.objects.filter(order_id=order_id)
+        # No-op write first: takes the write lock on SQLite and row locks
+        # elsewhere, so concurrent releases queue instead of conflicting.
+        if not reservations.update(quantity=F("quantity")):
+            return []
+        totals = list(
+            reservations.values("product_id").annotate(
+                total=Sum("quantity"), rows=Count("id")
+            )
+        )
+        deleted, _ = reservations.delete()
+        if deleted != sum(t["rows"] for t in totals):
+            raise _ReleaseConflict
+        product_ids = [t["product_id"] for t in totals]
+        released = Case(
+            *[When(product_id=t["product_id"], then=Value(t["total"])) for t in totals],
+            default=Value(0),
+            output_field=models.IntegerField(),
+        )
+        Stock.objects.filter(product_id__in=product_ids).update(
+            reserved=Greatest(F("reserved") - released, Value(0)),
+            updated_at=timezone.now(),
+        )
+        invalidate_stock(*product_ids)
+        emit_many(
+            "stock.released",
+            [
+                {
+                    "product_id": t["product_id"],
+                    "order_id": order_id,
+                    "quantity": t["total"],
+                }
+                for t in totals
+            ],
+        )
+    return product_ids
+
+
 @api.post("/release", response=ReserveOut)
 def release(request, order_id: str):
-    reservations = Reservation.objects.filter(order_id=order_id)
-    for r in reservations:
+    # Idempotent: a repeated or concurrent release finds nothing left to free
+    for _ in range(3):
         try:
-            stock = Stock.objects.get(product_id=r.product_id)
-            stock.reserved = max(0, stock.reserved - r.quantity)
-            stock.save(update_fields=["reserved"])
-        except Stock.DoesNotExist:
-            pass
-    reservations.delete()
-    return ReserveOut(success=True)
+            _release_order(order_id)
+            return ReserveOut(success=True)
+        except _ReleaseConflict:
+            continue
+    raise HttpError(409, "Reservations changed concurrently, retry")
@@ -0,0 +1,35 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from ninja.responses import NinjaJSONEncoder
+
+STOCK_LIST_KEY = "stock:list"
+
+
+def stock_key(product_id: str) -> str:
+    return f"stock:item:{product_id}"
+
+
+def cached_json_response(key: str, build) -> HttpResponse:
+    """Serve build()'s result as JSON from the shared cache, tagged with an
+    ETag so ConditionalGetMiddleware can answer If-None-Match with 304."""
+    entry = cache.get(key)
+    if entry is None:
+        body = json.dumps(build(), cls=NinjaJSONEncoder).encode()
+        entry = ('"%s"' % hashlib.sha1(body).hexdigest(), body)
+        cache.set(key, entry, settings.STOCK_CACHE_TTL)
+    etag, body = entry
+    response = HttpResponse(body, content_type="application/json")
+    response["ETag"] = etag
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+def invalidate_stock(*product_ids: str) -> None:
+    """Drop cached stock reads once the current transaction commits."""
+    keys = [STOCK_LIST_KEY] + [stock_key(p) for p in product_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,43 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...events import connect, relay_batch
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Publish outbox events to RabbitMQ in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="drain the outbox and exit"
+        )
+
+    def handle(self, *args, **options):
+        if not settings.RABBITMQ_URL:
+            raise CommandError("RABBITMQ_URL is not set")
+        broker = None
+        failures = 0
+        while True:
+            try:
+                if broker is None:
+                    broker = connect(settings.RABBITMQ_URL)
+                sent = relay_batch(broker, settings.EVENTS_BATCH_SIZE)
+                failures = 0
+            except Exception as e:
+                failures += 1
+                delay = min(30, 0.5 * 2 ** min(failures, 6))
+                logger.warning("Outbox relay failed (retry in %.1fs): %s", delay, e)
+                if broker is not None:
+                    broker.close()
+                    broker = None
+                time.sleep(delay)
+                continue
+            if sent < settings.EVENTS_BATCH_SIZE:
+                if options["once"]:
+                    return
+                time.sleep(settings.EVENTS_POLL_INTERVAL)
@@ -0,0 +1,135 @@
+import os
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction
+from django.db import connection
+from django.http import HttpResponse
+from django.utils.decorators import sync_and_async_middleware
+from ninja.renderers import JSONRenderer
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time to produce a response, per route",
+    ["method", "route"],
+)
+REQUESTS = Counter(
+    "http_requests_total", "Responses sent, per route and status", ["route", "status"]
+)
+IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Requests being handled", multiprocess_mode="livesum"
+)
+DB_QUERIES = Histogram(
+    "db_queries_per_request",
+    "SQL queries run while handling one request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+DB_TIME = Histogram(
+    "db_time_per_request_seconds",
+    "Time spent in SQL while handling one request",
+    ["route"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+SPAN = Histogram(
+    "span_duration_seconds", "Time spent in instrumented code paths", ["span"]
+)
+
+
+def timed(span: str):
+    """Record the duration of a block or function under `span`; usable as a
+    context manager or decorator, including around awaits."""
+    return SPAN.labels(span).time()
+
+
+class TimedJSONRenderer(JSONRenderer):
+    def render(self, request, data, *, response_status):
+        with timed("serialize"):
+            return super().render(request, data, response_status=response_status)
+
+
+class _QueryTimer:
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += perf_counter() - start
+
+
+def _route(request) -> str:
+    match = getattr(request, "resolver_match", None)
+    return match.route if match else "unmatched"
+
+
+def _record(request, status: int, elapsed: float) -> str:
+    route = _route(request)
+    REQUEST_LATENCY.labels(request.method, route).observe(elapsed)
+    REQUESTS.labels(route, status).inc()
+    return route
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """Latency, status and in-flight count per route. Sync requests also
+    record the queries they run; async ones hand ORM work to other threads,
+    so their queries are not attributed."""
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            IN_FLIGHT.inc()
+            start = perf_counter()
+            status = 500
+            try:
+                response = await get_response(request)
+                status = response.status_code
+                return response
+            finally:
+                IN_FLIGHT.dec()
+                _record(request, status, perf_counter() - start)
+
+    else:
+
+        def middleware(request):
+            IN_FLIGHT.inc()
+            timer = _QueryTimer()
+            start = perf_counter()
+            status = 500
+            try:
+                with connection.execute_wrapper(timer):
+                    response = get_response(request)
+                status = response.status_code
+                return response
+            finally:
+                IN_FLIGHT.dec()
+                route = _record(request, status, perf_counter() - start)
+                DB_QUERIES.labels(route).observe(timer.count)
+                DB_TIME.labels(route).observe(timer.seconds)
+
+    return middleware
+
+
+def metrics_view(request):
+    """Prometheus text exposition. With PROMETHEUS_MULTIPROC_DIR set (several
+    gunicorn workers) samples from every worker are merged."""
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
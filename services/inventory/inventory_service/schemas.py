@@ -1,3 +1,5 @@
+from typing import List
+
 from ninja import Schema
 
 
@@ -8,6 +10,15 @@ class StockOut(Schema):
     available: int
 
 
+class StockLookupIn(Schema):
+    ids: List[str]
+
+
+class StockLookupOut(Schema):
+    found: List[StockOut]
+    missing: List[str]
+
+
 class ReserveIn(Schema):
     product_id: str
     order_id: str
@@ -19,6 +30,38 @@ class ReserveOut(Schema):
     message: str = ""
 
 
+class ReserveItemIn(Schema):
+    product_id: str
+    quantity: int
+
+
+class BatchReserveIn(Schema):
+    order_id: str
+    items: List[ReserveItemIn]
+
+
+class ReserveItemOut(Schema):
+    product_id: str
+    quantity: int
+    success: bool
+    message: str = ""
+
+
+class BatchReserveOut(Schema):
+    success: bool
+    message: str = ""
+    items: List[ReserveItemOut] = []
+
+
+class StockSummaryOut(Schema):
+    total_products: int
+    total_quantity: int
+    total_reserved: int
+    total_available: int
+    low_stock_threshold: int
+    low_stock_count: int
+
+
 class StockIn(Schema):
     product_id: str
     quantity: int
@@ -15,8 +15,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "inventory_service.tracing.tracing_middleware",
+    "inventory_service.metrics.metrics_middleware",
     "django.middleware.security.SecurityMiddleware",
     "django.middleware.common.CommonMiddleware",
+    "django.middleware.http.ConditionalGetMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
@@ -27,6 +30,8 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": os.environ.get("DB_PATH", str(BASE_DIR / "db.sqlite3")),
+        # A file, not shared-cache memory, so concurrent tests wait on locks
+        "TEST": {"NAME": str(BASE_DIR / "test_db.sqlite3")},
     }
 }
 
@@ -35,3 +40,31 @@ TIME_ZONE = "UTC"
 USE_TZ = True
 STATIC_URL = "static/"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Shared response cache for stock reads (Redis when REDIS_URL is set)
+REDIS_URL = os.environ.get("REDIS_URL", "")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+STOCK_CACHE_TTL = int(os.environ.get("STOCK_CACHE_TTL", "5"))
+
+# Request tracing: span records go to TRACE_EXPORTER ("none", "jsonl" to
+# TRACE_FILE, "memory", or the dotted path of an exporter class)
+TRACE_SERVICE = "inventory"
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "none")
+TRACE_FILE = os.environ.get("TRACE_FILE", "/tmp/traces-inventory.jsonl")
+
+# Domain events go to an outbox table in the same transaction as the change;
+# relay_outbox publishes them to RabbitMQ (memory:// for an in-process
+# stand-in, empty disables events) in batches of EVENTS_BATCH_SIZE, polling
+# every EVENTS_POLL_INTERVAL seconds when the outbox is empty
+RABBITMQ_URL = os.environ.get("RABBITMQ_URL", "")
+EVENTS_SOURCE = "inventory"
+EVENTS_BATCH_SIZE = int(os.environ.get("EVENTS_BATCH_SIZE", "100"))
+EVENTS_POLL_INTERVAL = float(os.environ.get("EVENTS_POLL_INTERVAL", "0.2"))
@@ -0,0 +1,152 @@
+import threading
+from unittest import mock
+
+from django.db import connection
+from django.db.models import Sum
+from django.test import Client, TestCase, TransactionTestCase
+
+from . import api
+from .models import Reservation, Stock
+
+
+def post(client, path, data=None, **params):
+    query = "&".join(f"{k}={v}" for k, v in params.items())
+    return client.post(
+        f"{path}?{query}" if query else path,
+        data or {},
+        content_type="application/json",
+    )
+
+
+class ReserveConcurrencyTests(TransactionTestCase):
+    def test_parallel_reservations_never_oversell(self):
+        threads, units = 20, 7
+        Stock.objects.create(product_id="sku-1", quantity=units)
+        barrier = threading.Barrier(threads)
+        results = []
+
+        def reserve(i):
+            try:
+                barrier.wait()
+                response = Client().post(
+                    "/api/reserve",
+                    {"product_id": "sku-1", "order_id": f"o-{i}", "quantity": 1},
+                    content_type="application/json",
+                )
+                results.append(response.json()["success"])
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=reserve, args=(i,)) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(len(results), threads)
+        self.assertEqual(results.count(True), units)
+        stock = Stock.objects.get(product_id="sku-1")
+        self.assertEqual(stock.reserved, stock.quantity)
+        self.assertEqual(Reservation.objects.filter(product_id="sku-1").count(), units)
+
+    def test_releases_racing_reservations_keep_reserved_consistent(self):
+        threads = 20
+        Stock.objects.create(product_id="sku-2", quantity=100)
+        barrier = threading.Barrier(threads)
+        statuses = []
+
+        def work(i):
+            try:
+                barrier.wait()
+                client = Client()
+                if i % 2:
+                    response = post(client, "/api/release", order_id="o-race")
+                else:
+                    response = post(
+                        client,
+                        "/api/reserve",
+                        {"product_id": "sku-2", "order_id": "o-race", "quantity": 3},
+                    )
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=work, args=(i,)) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(statuses, [200] * threads)
+        held = Reservation.objects.filter(product_id="sku-2").aggregate(
+            total=Sum("quantity")
+        )["total"]
+        self.assertEqual(Stock.objects.get(product_id="sku-2").reserved, held or 0)
+
+
+class ReserveBatchTests(TestCase):
+    def setUp(self):
+        Stock.objects.create(product_id="a", quantity=5)
+        Stock.objects.create(product_id="b", quantity=1)
+
+    def test_partial_failure_rolls_back_the_whole_batch(self):
+        response = post(
+            self.client,
+            "/api/reserve/batch",
+            {
+                "order_id": "o-1",
+                "items": [
+                    {"product_id": "a", "quantity": 2},
+                    {"product_id": "b", "quantity": 3},
+                    {"product_id": "zzz", "quantity": 1},
+                ],
+            },
+        ).json()
+        self.assertFalse(response["success"])
+        self.assertEqual(
+            {i["product_id"]: i["message"] for i in response["items"]},
+            {"a": "", "b": "Insufficient stock", "zzz": "Product not found"},
+        )
+        self.assertEqual(Stock.objects.get(product_id="a").reserved, 0)
+        self.assertFalse(Reservation.objects.exists())
+
+
+class ReleaseTests(TestCase):
+    def setUp(self):
+        Stock.objects.create(product_id="a", quantity=5)
+        Stock.objects.create(product_id="b", quantity=5)
+        for product_id, quantity in (("a", 2), ("a", 1), ("b", 4)):
+            post(
+                self.client,
+                "/api/reserve",
+                {"product_id": product_id, "order_id": "o-1", "quantity": quantity},
+            )
+
+    def reserved(self):
+        return dict(Stock.objects.values_list("product_id", "reserved"))
+
+    def test_double_release_gives_stock_back_once(self):
+        self.assertEqual(self.reserved(), {"a": 3, "b": 4})
+        for _ in range(2):
+            response = post(self.client, "/api/release", order_id="o-1")
+            self.assertEqual(response.json()["success"], True)
+            self.assertEqual(self.reserved(), {"a": 0, "b": 0})
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_release_never_drives_reserved_negative(self):
+        Stock.objects.filter(product_id="a").update(reserved=1)
+        post(self.client, "/api/release", order_id="o-1")
+        self.assertEqual(self.reserved(), {"a": 0, "b": 0})
+
+    def test_conflicting_release_is_retried_then_409(self):
+        conflict = api._ReleaseConflict
+        for outcomes, status in (
+            ([conflict, conflict, ["a"]], 200),
+            ([conflict, conflict, conflict], 409),
+        ):
+            with mock.patch.object(
+                api, "_release_order", side_effect=outcomes
+            ) as release_order:
+                response = post(self.client, "/api/release", order_id="o-1")
+            self.assertEqual(response.status_code, status)
+            self.assertEqual(release_order.call_count, 3)
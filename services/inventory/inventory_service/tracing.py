@@ -0,0 +1,197 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+from django.utils.module_loading import import_string
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+REQUEST_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+@dataclass
+class Span:
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    service: str
+    start: float
+    duration_ms: float = 0.0
+    attributes: dict = field(default_factory=dict)
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+
+class JsonLinesExporter:
+    """Appends one JSON object per finished span to `path`."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "a", buffering=1)
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(asdict(span), default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+
+
+class InMemoryExporter:
+    """Keeps the most recent spans in memory, for tests and debugging."""
+
+    def __init__(self, max_spans: int = 10000):
+        self.spans: deque = deque(maxlen=max_spans)
+
+    def export(self, span: Span) -> None:
+        self.spans.append(span)
+
+    def clear(self) -> None:
+        self.spans.clear()
+
+
+class NullExporter:
+    def export(self, span: Span) -> None:
+        pass
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("trace_span", default=None)
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    """TRACE_EXPORTER is "jsonl" (to TRACE_FILE), "memory", "none", or the
+    dotted path of a class with an export(span) method."""
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                name = getattr(settings, "TRACE_EXPORTER", "none")
+                if name == "jsonl":
+                    _exporter = JsonLinesExporter(settings.TRACE_FILE)
+                elif name == "memory":
+                    _exporter = InMemoryExporter()
+                elif name == "none":
+                    _exporter = NullExporter()
+                else:
+                    _exporter = import_string(name)()
+    return _exporter
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def traceparent() -> Optional[str]:
+    """W3C traceparent for the active span, to hand to the next hop."""
+    span = _current.get()
+    return span.traceparent if span else None
+
+
+def inject(headers: Optional[dict]) -> dict:
+    """Copy of `headers` carrying the active trace context."""
+    headers = dict(headers or {})
+    span = _current.get()
+    if span is not None:
+        headers["traceparent"] = span.traceparent
+    return headers
+
+
+@contextmanager
+def span(name: str, trace_id: str = None, parent_id: str = None, **attributes):
+    """Child of the active span, or a new root unless `trace_id` and
+    `parent_id` continue a remote trace. Exported when the block exits."""
+    parent = _current.get()
+    if trace_id is None:
+        if parent is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            trace_id = _new_id(16)
+    s = Span(
+        trace_id=trace_id,
+        span_id=_new_id(8),
+        parent_id=parent_id,
+        name=name,
+        service=getattr(settings, "TRACE_SERVICE", ""),
+        start=time.time(),
+        attributes=attributes,
+    )
+    token = _current.set(s)
+    started = time.perf_counter()
+    try:
+        yield s
+    except BaseException as e:
+        s.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        s.duration_ms = (time.perf_counter() - started) * 1000
+        _current.reset(token)
+        get_exporter().export(s)
+
+
+def _remote_context(request) -> tuple:
+    """(trace_id, parent_id) from a valid traceparent header, else a trace id
+    from X-Request-ID (set by nginx) with no parent, else (None, None)."""
+    match = TRACEPARENT.match(request.headers.get("traceparent", ""))
+    if match and match.group(1) != "0" * 32:
+        return match.group(1), match.group(2)
+    request_id = request.headers.get("X-Request-ID", "")
+    if REQUEST_ID.match(request_id):
+        return request_id, None
+    return None, None
+
+
+def _server_span(request):
+    trace_id, parent_id = _remote_context(request)
+    return span(
+        f"{request.method} {request.path}",
+        trace_id=trace_id,
+        parent_id=parent_id,
+        method=request.method,
+        path=request.path,
+    )
+
+
+def _finish(request, s: Span, response) -> None:
+    match = getattr(request, "resolver_match", None)
+    if match:
+        s.name = f"{request.method} {match.route}"
+    s.attributes["status"] = response.status_code
+    response["X-Trace-Id"] = s.trace_id
+
+
+@sync_and_async_middleware
+def tracing_middleware(get_response):
+    """One server span per request, continuing the caller's trace."""
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            with _server_span(request) as s:
+                response = await get_response(request)
+                _finish(request, s, response)
+            return response
+
+    else:
+
+        def middleware(request):
+            with _server_span(request) as s:
+                response = get_response(request)
+                _finish(request, s, response)
+            return response
+
+    return middleware
@@ -1,7 +1,9 @@
 from django.urls import path
 from ninja import NinjaAPI
 from inventory_service.api import api
+from inventory_service.metrics import metrics_view
 
 urlpatterns = [
     path("api/", api.urls),
+    path("metrics", metrics_view),
 ]
@@ -1,11 +1,30 @@
+import base64
+import json
+from collections import defaultdict
+from datetime import datetime, timedelta
 from decimal import Decimal
+from typing import List, Optional, Union
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
 from ninja import NinjaAPI
 from ninja.errors import HttpError
 
+from .events import emit, emit_many
+from .metrics import TimedJSONRenderer
 from .models import Order, OrderItem
-from .schemas import OrderCreateIn, OrderOut, OrderItemOut, OrderStatusIn
+from .schemas import (
+    OrderCreateIn,
+    OrderItemOut,
+    OrderOut,
+    OrderPageOut,
+    OrdersBulkIn,
+    OrderStatusIn,
+    OrderSummaryOut,
+)
 
-api = NinjaAPI(title="Orders API", version="1.0")
+api = NinjaAPI(title="Orders API", version="1.0", renderer=TimedJSONRenderer())
 
 
 def _order_to_out(order: Order) -> OrderOut:
@@ -25,33 +44,215 @@ def _order_to_out(order: Order) -> OrderOut:
     )
 
 
-@api.get("/orders", response=list[OrderOut])
-def list_orders(request, user_id: int):
-    orders = Order.objects.filter(user_id=user_id).order_by("-created_at")
-    return [_order_to_out(o) for o in orders]
+ORDER_FIELDS = ("id", "user_id", "status", "total_amount", "created_at")
+ITEM_FIELDS = ("order_id", "product_id", "quantity", "unit_price")
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MAX_BULK_ORDERS = 1000
+CENTS = Decimal("0.01")
+
+
+def _rows_to_out(orders: list, include_items: bool = True) -> list[OrderOut]:
+    """Build OrderOut from Order .values() rows, fetching the items of all of
+    them in one query instead of one per order."""
+    items = defaultdict(list)
+    if orders and include_items:
+        for i in (
+            OrderItem.objects.filter(order_id__in=[o["id"] for o in orders])
+            .order_by("id")
+            .values(*ITEM_FIELDS)
+        ):
+            items[i.pop("order_id")].append(OrderItemOut(**i))
+    return [
+        OrderOut(
+            **{**o, "created_at": o["created_at"].isoformat()},
+            items=items[o["id"]],
+        )
+        for o in orders
+    ]
+
+
+def _encode_cursor(row: dict) -> str:
+    raw = json.dumps([row["created_at"].isoformat(), row["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, order_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(order_id)
+    except (ValueError, TypeError):
+        raise HttpError(400, "Invalid cursor")
+
+
+@api.get("/orders", response=Union[List[OrderOut], OrderPageOut])
+def list_orders(
+    request,
+    user_id: int,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    include_items: bool = True,
+    reference: Optional[str] = None,
+):
+    """Newest orders first. Without limit/cursor every order is returned as a
+    plain list; otherwise one keyset page on (created_at, id) with an opaque
+    next_cursor. include_items=false skips the item rows entirely."""
+    orders = Order.objects.filter(user_id=user_id).order_by("-created_at", "-id")
+    if reference is not None:
+        orders = orders.filter(reference=reference)
+    if limit is None and cursor is None:
+        return _rows_to_out(list(orders.values(*ORDER_FIELDS)), include_items)
+    if cursor:
+        created_at, order_id = _decode_cursor(cursor)
+        orders = orders.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=order_id)
+        )
+    limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    rows = list(orders.values(*ORDER_FIELDS)[: limit + 1])
+    next_cursor = _encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return OrderPageOut(
+        results=_rows_to_out(rows[:limit], include_items), next_cursor=next_cursor
+    )
+
+
+def _create_orders(payloads: list) -> list[OrderOut]:
+    """Insert the orders and all of their items in one transaction, with one
+    bulk INSERT per table."""
+    with transaction.atomic():
+        orders = Order.objects.bulk_create(
+            Order(
+                user_id=p.user_id,
+                reference=p.reference,
+                total_amount=sum(Decimal(i.quantity) * i.unit_price for i in p.items),
+            )
+            for p in payloads
+        )
+        OrderItem.objects.bulk_create(
+            OrderItem(
+                order=order,
+                product_id=i.product_id,
+                quantity=i.quantity,
+                unit_price=i.unit_price,
+            )
+            for order, p in zip(orders, payloads)
+            for i in p.items
+        )
+        emit_many(
+            "order.created",
+            [
+                {
+                    "order_id": order.id,
+                    "user_id": order.user_id,
+                    "status": order.status,
+                    "total_amount": Decimal(order.total_amount).quantize(CENTS),
+                }
+                for order in orders
+            ],
+        )
+    return [
+        OrderOut(
+            id=order.id,
+            user_id=order.user_id,
+            status=order.status,
+            total_amount=Decimal(order.total_amount).quantize(CENTS),
+            created_at=order.created_at.isoformat(),
+            items=[
+                OrderItemOut(
+                    product_id=i.product_id,
+                    quantity=i.quantity,
+                    unit_price=i.unit_price.quantize(CENTS),
+                )
+                for i in p.items
+            ],
+        )
+        for order, p in zip(orders, payloads)
+    ]
+
+
+def _order_with_reference(user_id: int, reference: str) -> Optional[OrderOut]:
+    rows = list(
+        Order.objects.filter(user_id=user_id, reference=reference).values(*ORDER_FIELDS)
+    )
+    return _rows_to_out(rows)[0] if rows else None
+
+
+def _references_taken(payloads: list) -> bool:
+    """Whether the reference constraint is what rejected `payloads`: a
+    reference repeated within them, or one its user already has."""
+    pairs = [(p.user_id, p.reference) for p in payloads if p.reference]
+    if len(set(pairs)) < len(pairs):
+        return True
+    taken = Q(pk__in=[])
+    for user_id, reference in pairs:
+        taken |= Q(user_id=user_id, reference=reference)
+    return bool(pairs) and Order.objects.filter(taken).exists()
 
 
 @api.post("/orders", response=OrderOut)
 def create_order(request, payload: OrderCreateIn):
-    total = sum(Decimal(i.quantity) * i.unit_price for i in payload.items)
-    order = Order.objects.create(user_id=payload.user_id, total_amount=total)
-    for item in payload.items:
-        OrderItem.objects.create(
-            order=order,
-            product_id=item.product_id,
-            quantity=item.quantity,
-            unit_price=item.unit_price,
+    if payload.reference:
+        existing = _order_with_reference(payload.user_id, payload.reference)
+        if existing is not None:
+            return existing
+    try:
+        return _create_orders([payload])[0]
+    except IntegrityError:
+        # A concurrent create with the same reference won; anything else is
+        # a real failure
+        existing = payload.reference and _order_with_reference(
+            payload.user_id, payload.reference
         )
-    return _order_to_out(order)
+        if not existing:
+            raise
+        return existing
+
+
+@api.post("/orders/bulk", response=list[OrderOut])
+def create_orders_bulk(request, payload: OrdersBulkIn):
+    if len(payload.orders) > MAX_BULK_ORDERS:
+        raise HttpError(400, f"At most {MAX_BULK_ORDERS} orders per request")
+    try:
+        return _create_orders(payload.orders)
+    except IntegrityError:
+        if not _references_taken(payload.orders):
+            raise
+        raise HttpError(409, "Order reference already in use")
+
+
+@api.get("/orders/summary", response=OrderSummaryOut)
+def orders_summary(request, user_id: int, days: Optional[int] = None, recent: int = 3):
+    """Order counts and totals per status, aggregated in the database. `days`
+    limits the window to the last N days (all time when omitted)."""
+    orders = Order.objects.filter(user_id=user_id)
+    since = None
+    if days is not None:
+        since = timezone.now() - timedelta(days=days)
+        orders = orders.filter(created_at__gte=since)
+    by_status = list(
+        orders.order_by()
+        .values("status")
+        .annotate(count=Count("id"), total_amount=Sum("total_amount"))
+        .order_by("status")
+    )
+    for row in by_status:
+        row["total_amount"] = Decimal(row["total_amount"] or 0).quantize(CENTS)
+    latest = orders.order_by("-created_at", "-id").values("id", "status")
+    return OrderSummaryOut(
+        since=since.isoformat() if since else None,
+        total_orders=sum(row["count"] for row in by_status),
+        total_amount=sum((row["total_amount"] for row in by_status), Decimal("0.00")),
+        by_status=by_status,
+        recent=list(latest[: max(0, min(recent, MAX_PAGE_SIZE))]),
+    )
 
 
 @api.get("/orders/{order_id}", response=OrderOut)
 def get_order(request, order_id: int):
-    try:
-        order = Order.objects.get(pk=order_id)
-    except Order.DoesNotExist:
+    orders = list(Order.objects.filter(pk=order_id).values(*ORDER_FIELDS))
+    if not orders:
         raise HttpError(404, "Order not found")
-    return _order_to_out(order)
+    return _rows_to_out(orders)[0]
 
 
 @api.patch("/orders/{order_id}", response=OrderOut)
@@ -62,6 +263,15 @@ def update_order_status(request, order_id: int, payload: OrderStatusIn):
         raise HttpError(404, "Order not found")
     if payload.status not in dict(Order.Status.choices):
         raise HttpError(400, "Invalid status")
-    order.status = payload.status
-    order.save(update_fields=["status", "updated_at"])
+    previous, order.status = order.status, payload.status
+    with transaction.atomic():
+        order.save(update_fields=["status", "updated_at"])
+        if previous != order.status:
+            emit(
+                "order.status_changed",
+                order_id=order.id,
+                user_id=order.user_id,
+                status=order.status,
+                previous_status=previous,
+            )
     return _order_to_out(order)
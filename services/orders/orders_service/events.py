@@ -0,0 +1,110 @@
+import json
+import logging
+from collections import deque
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+EXCHANGE = "soa.events"
+
+
+class MemoryBroker:
+    """In-process stand-in for RabbitMQ (RABBITMQ_URL=memory://), for tests
+    and local runs: keeps what was published and calls subscribers."""
+
+    def __init__(self, max_messages: int = 10000):
+        self.messages: deque = deque(maxlen=max_messages)
+        self.subscribers = []
+
+    def send(self, routing_key: str, body: bytes, message_id: str) -> None:
+        self.messages.append((routing_key, body, message_id))
+        for subscriber in self.subscribers:
+            subscriber(routing_key, body, message_id)
+
+    def close(self) -> None:
+        pass
+
+
+memory_broker = MemoryBroker()
+
+
+class _RabbitMQ:
+    """Channel in confirm mode: send() returns once the broker has the message."""
+
+    def __init__(self, url: str):
+        import pika
+
+        self._pika = pika
+        self.connection = pika.BlockingConnection(pika.URLParameters(url))
+        self.channel = self.connection.channel()
+        self.channel.exchange_declare(EXCHANGE, exchange_type="topic", durable=True)
+        self.channel.confirm_delivery()
+
+    def send(self, routing_key: str, body: bytes, message_id: str) -> None:
+        self.channel.basic_publish(
+            EXCHANGE,
+            routing_key,
+            body,
+            properties=self._pika.BasicProperties(
+                content_type="application/json",
+                delivery_mode=2,
+                message_id=message_id,
+            ),
+        )
+
+    def close(self) -> None:
+        try:
+            self.connection.close()
+        except Exception:
+            pass
+
+
+def connect(url: str):
+    if url.startswith("memory://"):
+        return memory_broker
+    return _RabbitMQ(url)
+
+
+def emit_many(event_type: str, payloads: list) -> None:
+    """Record events in the outbox as part of the caller's transaction, so
+    they are published if and only if the change commits."""
+    if not settings.RABBITMQ_URL or not payloads:
+        return
+    OutboxEvent.objects.bulk_create(
+        OutboxEvent(event_type=event_type, payload=p) for p in payloads
+    )
+
+
+def emit(event_type: str, **data) -> None:
+    emit_many(event_type, [data])
+
+
+def _event(row: OutboxEvent) -> dict:
+    return {
+        # Stable across redeliveries, so consumers can drop duplicates
+        "event_id": f"{settings.EVENTS_SOURCE}:{row.id}",
+        "type": row.event_type,
+        "source": settings.EVENTS_SOURCE,
+        "occurred_at": row.created_at,
+        **row.payload,
+    }
+
+
+def relay_batch(broker, batch_size: int) -> int:
+    """Publish the oldest outbox events as one confirmed message and delete
+    them. A crash between the two publishes them again (at-least-once).
+    Returns how many events were sent."""
+    rows = list(OutboxEvent.objects.order_by("id")[:batch_size])
+    if not rows:
+        return 0
+    body = json.dumps(
+        {"events": [_event(r) for r in rows]}, cls=DjangoJSONEncoder
+    ).encode()
+    message_id = f"{settings.EVENTS_SOURCE}:{rows[0].id}-{rows[-1].id}"
+    broker.send(f"{settings.EVENTS_SOURCE}.events", body, message_id)
+    OutboxEvent.objects.filter(id__in=[r.id for r in rows]).delete()
+    return len(rows)
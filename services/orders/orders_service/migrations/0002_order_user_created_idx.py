@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("orders_service", "0001_initial"),
+    ]
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["user_id", "created_at", "id"], name="order_user_created_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders_service", "0003_outboxevent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="reference",
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
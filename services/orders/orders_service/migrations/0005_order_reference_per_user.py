@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders_service", "0004_order_reference"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="order",
+            name="reference",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name="order",
+            constraint=models.UniqueConstraint(
+                fields=("user_id", "reference"), name="order_user_reference_uniq"
+            ),
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
 
@@ -9,6 +10,10 @@ class Order(models.Model):
         CANCELLED = "cancelled", "Cancelled"
 
     user_id = models.IntegerField()
+    # Caller-chosen key, unique per user: creating an order with a reference
+    # the user already has returns that order, and callers can look it up
+    # after a lost response
+    reference = models.CharField(max_length=64, null=True, blank=True)
     status = models.CharField(
         max_length=20, choices=Status.choices, default=Status.PENDING
     )
@@ -16,9 +21,31 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of a user's orders, newest first
+            models.Index(
+                fields=["user_id", "created_at", "id"], name="order_user_created_idx"
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user_id", "reference"], name="order_user_reference_uniq"
+            ),
+        ]
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="items")
     product_id = models.CharField(max_length=64)
     quantity = models.PositiveIntegerField()
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+
+class OutboxEvent(models.Model):
+    """Domain event waiting to be published, written in the same transaction
+    as the change it describes and deleted once the broker confirms it."""
+
+    event_type = models.CharField(max_length=64)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
@@ -1,17 +1,22 @@
 from decimal import Decimal
-from ninja import Schema
-from typing import List
+from ninja import Field, Schema
+from typing import List, Optional
 
 
 class OrderItemIn(Schema):
     product_id: str
-    quantity: int
+    quantity: int = Field(..., gt=0)
     unit_price: Decimal
 
 
 class OrderCreateIn(Schema):
     user_id: int
     items: List[OrderItemIn]
+    reference: Optional[str] = None
+
+
+class OrdersBulkIn(Schema):
+    orders: List[OrderCreateIn]
 
 
 class OrderItemOut(Schema):
@@ -29,5 +34,29 @@ class OrderOut(Schema):
     items: List[OrderItemOut] = []
 
 
+class OrderPageOut(Schema):
+    results: List[OrderOut]
+    next_cursor: Optional[str] = None
+
+
+class OrderStatusSummaryOut(Schema):
+    status: str
+    count: int
+    total_amount: Decimal
+
+
+class OrderRecentOut(Schema):
+    id: int
+    status: str
+
+
+class OrderSummaryOut(Schema):
+    since: Optional[str] = None
+    total_orders: int
+    total_amount: Decimal
+    by_status: List[OrderStatusSummaryOut]
+    recent: List[OrderRecentOut]
+
+
 class OrderStatusIn(Schema):
     status: str
@@ -13,6 +13,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "orders_service.tracing.tracing_middleware",
+    "orders_service.metrics.metrics_middleware",
     "django.middleware.security.SecurityMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
@@ -33,3 +35,18 @@ TIME_ZONE = "UTC"
 USE_TZ = True
 STATIC_URL = "static/"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Request tracing: span records go to TRACE_EXPORTER ("none", "jsonl" to
+# TRACE_FILE, "memory", or the dotted path of an exporter class)
+TRACE_SERVICE = "orders"
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "none")
+TRACE_FILE = os.environ.get("TRACE_FILE", "/tmp/traces-orders.jsonl")
+
+# Domain events go to an outbox table in the same transaction as the change;
+# relay_outbox publishes them to RabbitMQ (memory:// for an in-process
+# stand-in, empty disables events) in batches of EVENTS_BATCH_SIZE, polling
+# every EVENTS_POLL_INTERVAL seconds when the outbox is empty
+RABBITMQ_URL = os.environ.get("RABBITMQ_URL", "")
+EVENTS_SOURCE = "orders"
+EVENTS_BATCH_SIZE = int(os.environ.get("EVENTS_BATCH_SIZE", "100"))
+EVENTS_POLL_INTERVAL = float(os.environ.get("EVENTS_POLL_INTERVAL", "0.2"))
@@ -0,0 +1,198 @@
+import base64
+import json
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .api import _decode_cursor, _encode_cursor
+from .events import memory_broker, relay_batch
+from .models import Order, OrderItem, OutboxEvent
+
+
+class OrderQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        orders = Order.objects.bulk_create(
+            Order(user_id=1, total_amount=Decimal("3.00")) for _ in range(50)
+        )
+        OrderItem.objects.bulk_create(
+            OrderItem(
+                order=order,
+                product_id=f"p{i}",
+                quantity=1,
+                unit_price=Decimal("1.00"),
+            )
+            for order in orders
+            for i in range(3)
+        )
+        cls.order = orders[0]
+
+    def test_list_orders_is_two_queries(self):
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/orders", {"user_id": 1})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(len(body), 50)
+        self.assertTrue(all(len(order["items"]) == 3 for order in body))
+
+    def test_list_orders_page_is_two_queries(self):
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/orders", {"user_id": 1, "limit": 20})
+        self.assertEqual(len(response.json()["results"]), 20)
+
+    def test_get_order_is_two_queries(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(f"/api/orders/{self.order.id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["items"]), 3)
+
+
+class OrderCursorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Order.objects.bulk_create(
+            Order(user_id=2, total_amount=Decimal("1.00")) for _ in range(10)
+        )
+        # Seven orders share a timestamp, so pages must break ties on id
+        now = timezone.now()
+        ids = list(Order.objects.order_by("id").values_list("id", flat=True))
+        Order.objects.filter(id__in=ids[3:]).update(created_at=now)
+        for age, order_id in enumerate(ids[:3], start=1):
+            Order.objects.filter(id=order_id).update(
+                created_at=now - timedelta(minutes=age)
+            )
+        cls.newest_first = ids[3:][::-1] + ids[:3]
+
+    def page(self, cursor=None):
+        params = {"user_id": 2, "limit": 3, "include_items": False}
+        if cursor:
+            params["cursor"] = cursor
+        return self.client.get("/api/orders", params)
+
+    def test_cursor_round_trips(self):
+        created_at = timezone.now()
+        cursor = _encode_cursor({"created_at": created_at, "id": 42})
+        self.assertNotIn("=", cursor)
+        self.assertEqual(_decode_cursor(cursor), (created_at, 42))
+
+    def test_pages_cover_equal_timestamps_once_in_order(self):
+        seen, cursor, pages = [], None, 0
+        while True:
+            body = self.page(cursor).json()
+            seen += [o["id"] for o in body["results"]]
+            pages += 1
+            cursor = body["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(seen, self.newest_first)
+        self.assertEqual(pages, 4)
+
+    def test_malformed_cursor_is_400(self):
+        for raw in (b"[1]", b'{"a": 1}', b'["yesterday", 1]', b"[null, 1]", b"\xff"):
+            cursor = base64.urlsafe_b64encode(raw).decode()
+            self.assertEqual(self.page(cursor).status_code, 400, raw)
+        self.assertEqual(self.page("not-a-cursor!").status_code, 400)
+
+
+@override_settings(RABBITMQ_URL="memory://")
+class OutboxTests(TestCase):
+    def test_created_order_is_published_from_the_outbox(self):
+        received = []
+        memory_broker.subscribers.append(
+            lambda key, body, message_id: received.append((key, body, message_id))
+        )
+        self.addCleanup(memory_broker.subscribers.clear)
+        response = self.client.post(
+            "/api/orders",
+            {
+                "user_id": 7,
+                "items": [{"product_id": "p1", "quantity": 1, "unit_price": "2.50"}],
+            },
+            content_type="application/json",
+        )
+        order_id = response.json()["id"]
+        self.assertEqual(OutboxEvent.objects.count(), 1)
+
+        self.assertEqual(relay_batch(memory_broker, 100), 1)
+
+        self.assertFalse(OutboxEvent.objects.exists())
+        [(key, body, message_id)] = received
+        [event] = json.loads(body)["events"]
+        self.assertEqual(key, "orders.events")
+        self.assertEqual(event["type"], "order.created")
+        self.assertEqual(event["order_id"], order_id)
+        self.assertEqual(event["user_id"], 7)
+        row_id = event["event_id"].removeprefix("orders:")
+        self.assertEqual(message_id, f"orders:{row_id}-{row_id}")
+
+
+class OrderReferenceTests(TestCase):
+    def create(self, reference, user_id=3):
+        return self.client.post(
+            "/api/orders",
+            {
+                "user_id": user_id,
+                "reference": reference,
+                "items": [{"product_id": "p1", "quantity": 1, "unit_price": "1.00"}],
+            },
+            content_type="application/json",
+        ).json()
+
+    def test_repeated_create_returns_the_first_order(self):
+        first = self.create("checkout-1")
+        self.assertEqual(self.create("checkout-1")["id"], first["id"])
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_orders_can_be_found_by_reference(self):
+        order = self.create("checkout-2")
+        self.create("checkout-3")
+        found = self.client.get(
+            "/api/orders", {"user_id": 3, "reference": "checkout-2"}
+        ).json()
+        self.assertEqual([o["id"] for o in found], [order["id"]])
+
+    def test_references_are_scoped_to_their_user(self):
+        mine = self.create("checkout-4", user_id=3)
+        theirs = self.create("checkout-4", user_id=4)
+        self.assertNotEqual(theirs["id"], mine["id"])
+        self.assertEqual(theirs["user_id"], 4)
+        self.assertEqual(Order.objects.count(), 2)
+
+
+class OrderCreateErrorTests(TestCase):
+    def order(self, reference=None, quantity=1):
+        return {
+            "user_id": 3,
+            "reference": reference,
+            "items": [{"product_id": "p1", "quantity": quantity, "unit_price": "1"}],
+        }
+
+    def post(self, path, data):
+        return self.client.post(path, data, content_type="application/json")
+
+    def test_quantities_must_be_positive(self):
+        for quantity in (0, -1):
+            response = self.post("/api/orders", self.order(quantity=quantity))
+            self.assertEqual(response.status_code, 422)
+        self.assertFalse(Order.objects.exists())
+
+    def test_bulk_reference_conflicts_are_409(self):
+        self.post("/api/orders", self.order("taken"))
+        for refs in (["a", "a"], ["b", "taken"]):
+            orders = [self.order(ref) for ref in refs]
+            response = self.post("/api/orders/bulk", {"orders": orders})
+            self.assertEqual(response.status_code, 409)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_other_integrity_errors_are_not_reported_as_conflicts(self):
+        with mock.patch(
+            "orders_service.api._create_orders", side_effect=IntegrityError
+        ):
+            with self.assertRaises(IntegrityError):
+                self.post("/api/orders", self.order("fresh"))
+            with self.assertRaises(IntegrityError):
+                self.post("/api/orders/bulk", {"orders": [self.order("fresh")]})